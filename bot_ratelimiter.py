@@ -0,0 +1,129 @@
+"""Rate limiter for all requests the bot sends to the Telegram Bot API.
+
+Plugged into the Application with ApplicationBuilder.rate_limiter(), so reminders and interactive
+replies (send_message, edit_message_text, ...) all pass through the same queue:
+- a global token bucket keeps the bot below Telegram's overall limit,
+- a token bucket per chat keeps single chats below the per-chat limit (stricter for groups),
+- a semaphore bounds the number of requests in flight,
+- RetryAfter (HTTP 429) pauses all requests for the requested time and retries with backoff.
+"""
+import asyncio
+import logging
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Allows rate requests per second on average and bursts of up to capacity requests."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def isFull(self) -> bool:
+        self.refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it. Waiters are served in order."""
+        async with self.lock:
+            while True:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class MessageRateLimiter(BaseRateLimiter):
+    """Throttles outgoing requests and retries them when Telegram answers with RetryAfter."""
+
+    def __init__(self, globalRate: float = 25, globalBurst: float = 30, chatRate: float = 1, chatBurst: float = 3,
+                 groupRate: float = 20 / 60, groupBurst: float = 3, maxConcurrent: int = 8, maxRetries: int = 3,
+                 backoffBase: float = 1.0):
+        self.globalRate = globalRate
+        self.globalBurst = globalBurst
+        self.chatRate = chatRate
+        self.chatBurst = chatBurst
+        self.groupRate = groupRate
+        self.groupBurst = groupBurst
+        self.maxConcurrent = maxConcurrent
+        self.maxRetries = maxRetries
+        self.backoffBase = backoffBase
+        self.globalBucket = None
+        self.chatBuckets = {}
+        self.concurrency = None
+        self.pausedUntil = 0.0
+        self.metrics = {"queued": 0, "in_flight": 0, "sent": 0, "retried": 0, "dropped": 0}
+
+    async def initialize(self) -> None:
+        self.globalBucket = TokenBucket(self.globalRate, self.globalBurst)
+        self.concurrency = asyncio.Semaphore(self.maxConcurrent)
+
+    async def shutdown(self) -> None:
+        self.chatBuckets.clear()
+
+    def getMetrics(self) -> dict:
+        return dict(self.metrics)
+
+    def chatBucket(self, chatId) -> TokenBucket:
+        bucket = self.chatBuckets.get(chatId)
+        if bucket is None:
+            # drop buckets of idle chats so the dict does not grow with every chat ever seen
+            for idleChat in [c for c, b in self.chatBuckets.items() if b.isFull()]:
+                del self.chatBuckets[idleChat]
+            isGroup = (isinstance(chatId, int) and chatId < 0) or isinstance(chatId, str)
+            if isGroup:
+                bucket = TokenBucket(self.groupRate, self.groupBurst)
+            else:
+                bucket = TokenBucket(self.chatRate, self.chatBurst)
+            self.chatBuckets[chatId] = bucket
+        return bucket
+
+    async def waitForSlot(self, chatId) -> None:
+        pause = self.pausedUntil - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        if chatId is not None:
+            await self.chatBucket(chatId).acquire()
+        await self.globalBucket.acquire()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chatId = data.get("chat_id")
+        attempt = 0
+        while True:
+            self.metrics["queued"] += 1
+            try:
+                await self.waitForSlot(chatId)
+                await self.concurrency.acquire()
+            finally:
+                self.metrics["queued"] -= 1
+            self.metrics["in_flight"] += 1
+            try:
+                result = await callback(*args, **kwargs)
+                self.metrics["sent"] += 1
+                return result
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > self.maxRetries:
+                    self.metrics["dropped"] += 1
+                    logger.warning("%s to chat %s dropped after %d retries", endpoint, chatId, self.maxRetries)
+                    raise
+                self.metrics["retried"] += 1
+                retryAfter = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                delay = retryAfter + self.backoffBase * 2 ** (attempt - 1)
+                self.pausedUntil = max(self.pausedUntil, time.monotonic() + delay)
+                logger.info("Flood limit on %s, retrying in %.1fs (attempt %d)", endpoint, delay, attempt)
+            finally:
+                self.metrics["in_flight"] -= 1
+                self.concurrency.release()
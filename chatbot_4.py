@@ -11,12 +11,29 @@ ConversationHandler.
 Send /start to initiate the conversation.
 Press Ctrl-C on the command line to stop the bot.
 """
+import argparse
+import asyncio
+import io
 import logging
+import os
 import re
-from enum import Enum
+import tempfile
 from datetime import datetime, time
 from dateutil.relativedelta import relativedelta
-import contract_dbqueries
+import contract_dbqueries_async
+import contract_cache
+import contract_export
+import contract_forecast
+import contract_import
+from user_input import UserInputType, userInputRegexMap
+from contract_rows import ContractView
+from contract_dueindex import dueIndex
+from bot_ratelimiter import MessageRateLimiter
+from update_processor import ChatOrderedUpdateProcessor
+import webhook_server
+import metrics
+import slow_query_log
+from paginated_keyboard import PaginatedKeyboard, turnPage, pagePattern
 from telegram import __version__ as TG_VER
 
 try:
@@ -31,6 +48,8 @@ if __version_info__ < (20, 0, 0, "alpha", 1):
         f"visit https://docs.python-telegram-bot.org/en/v{TG_VER}/examples.html"
     )
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import (
     Application,
     filters,
@@ -40,6 +59,8 @@ from telegram.ext import (
     ContextTypes,
     Updater,
     ConversationHandler,
+    TypeHandler,
+    ApplicationHandlerStop,
 )
 
 # Enable logging
@@ -48,40 +69,55 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# User Input Types
-class UserInputType(Enum):
-    DATE = 1
-    MONETARY = 2
-    AMOUNT = 3
-
-
-# Mapping of UserInputType and RegEx to check
-userInputRegexMap = {
-    UserInputType.DATE : "^(\d{2})\.(\d{2})\.(\d{4})$",
-    UserInputType.MONETARY : "^(\d+,\d{2}|\d+)$",
-    UserInputType.AMOUNT : "^\d+$"
-}
-
+# Days before the cancellation date at which a contract is reminded of (once per milestone)
+alertMilestones = (14, 7, 1)
+# Daily time of the reminder job
+alertTime = time(hour = 7, minute = 20, second = 0)
+# Send one digest message per chat instead of one message per contract
+alertDigestMode = True
+# Largest CSV document accepted for the contract import
+importMaxBytes = 1024 * 1024
 
 # Stages
 START, STARTALERTS, CHOOSE, CATEGORY, TYPE, CONTRACT, DETAILS, NEWCONTRACT, SETCATEGORY, SETRENEWALPERIOD, SETTYPE, SETBENEFICIARY, SETPERIOD, SETCONTRACTOR, SETSTARTDATE, SETENDDATE, SETNOTICEPERIOD, SETFEE, SETACCOUNT, SAVECONTRACT, REALLYDELETE, NEWCATEGORY, NEWTYPE, CONTRACT_ALERTING = range(24)
-   
+# Names of the stages, used as metrics labels
+stageNames = dict(enumerate(["START", "STARTALERTS", "CHOOSE", "CATEGORY", "TYPE", "CONTRACT", "DETAILS", "NEWCONTRACT", "SETCATEGORY", "SETRENEWALPERIOD",
+                             "SETTYPE", "SETBENEFICIARY", "SETPERIOD", "SETCONTRACTOR", "SETSTARTDATE", "SETENDDATE", "SETNOTICEPERIOD", "SETFEE",
+                             "SETACCOUNT", "SAVECONTRACT", "REALLYDELETE", "NEWCATEGORY", "NEWTYPE", "CONTRACT_ALERTING"]))
+
+# Paginated keyboards, one page of rows per screen
+def categoryButton(c) -> InlineKeyboardButton:
+    return InlineKeyboardButton(c.contract_category, callback_data=str(c.contract_category_id))
+
+categoryKeyboard = PaginatedKeyboard("categories", contract_dbqueries_async.getContractCategoriesPage, lambda c: c.contract_category_id, categoryButton, columns=2,
+                                     extraRows=lambda *args: [[InlineKeyboardButton("Neue Kategorie anlegen", callback_data="new_category")]])
+activeCategoryKeyboard = PaginatedKeyboard("activeCategories", contract_dbqueries_async.getActiveContractCategoriesPage, lambda c: c.contract_category_id, categoryButton,
+                                           extraRows=lambda *args: [[InlineKeyboardButton("\U000025C0 zurück", callback_data="back")]])
+contractKeyboard = PaginatedKeyboard("contracts", contract_dbqueries_async.getContractsPage, lambda c: c.contract_id,
+                                     lambda c: InlineKeyboardButton(str(c.contract_type) + " bei " + str(c.contractor_name), callback_data=str(c.contract_id)))
+contractorKeyboard = PaginatedKeyboard("contractors", contract_dbqueries_async.getContractorsPage, lambda c: (c.contractor_name, c.contractor_id),
+                                       lambda c: InlineKeyboardButton(str(c.contractor_name), callback_data=str(c.contractor_id)))
+
 async def makeValidDateString(inputDate: str) -> str:
     """transforms a date input string into a valid date that can be saved in the database, e.g. 2024-12-31"""
     validDateString = inputDate
     regEx = userInputRegexMap[UserInputType.DATE]
     matches = re.search(regEx, inputDate)
-    if (len(matches)> 0):
+    if (matches):
         validDateString = matches.group(3)+"-"+matches.group(2)+"-"+matches.group(1)
     return validDateString
 
+def alertChats(context: ContextTypes.DEFAULT_TYPE) -> dict:
+    """Chats that receive reminders, mapped to the user whose contracts they get."""
+    return context.bot_data.setdefault("alertChats", {})
+
 async def startAlerts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
     keyboard = []
     chat_id = update.effective_message.chat_id
 
-    if (context.job_queue.get_jobs_by_name("Alerts-"+str(chat_id))):
+    if (chat_id in alertChats(context)):
         text = "Erinnerungen sind bereits aktiv."
         keyboard.append([InlineKeyboardButton("Erinnerungen deaktivieren!", callback_data="stopalerts")])
     else:
@@ -97,8 +133,8 @@ async def startAlerts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     #print(str(update.message.from_user.id))
-    if not (contract_dbqueries.isValidUser(context._user_id)):
-        await update.message.reply_text("Sorry, du bist nicht berechtigt!")
+    if not (await contract_dbqueries_async.isAuthorized(update.effective_user.id)):
+        await update.effective_message.reply_text("Sorry, du bist nicht berechtigt!")
         return ConversationHandler.END
         
     else:
@@ -116,24 +152,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return CHOOSE
     
 
+async def rejectUnauthorized(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drop updates of users that were already rejected, before any other handler (or the database) sees them."""
+    user = update.effective_user
+    if user is not None and contract_dbqueries_async.isKnownUnauthorized(user.id):
+        raise ApplicationHandlerStop
+
 async def newcontract(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    keyboard = []
-    categories = []
-    categories = contract_dbqueries.getContractCategories()
-    categoryCount = len(categories)
-    for cid, c in enumerate(categories):
-        if (cid % 2 == 0):
-            if (cid == categoryCount-1):
-                keyboard.append([InlineKeyboardButton(categories[cid][1], callback_data=categories[cid][0])])
-            else:
-                logger.info("at category ID: " +str(cid))
-                keyboard.append([InlineKeyboardButton(categories[cid][1], callback_data=categories[cid][0]), InlineKeyboardButton(categories[cid+1][1], callback_data=categories[cid+1][0])])
-    
-    keyboard.append([InlineKeyboardButton("Neue Kategorie anlegen", callback_data="new_category")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup, _ = await categoryKeyboard.firstPage(context)
     # Send message with text and appended InlineKeyboard
     await query.edit_message_text("Gib eine Kategorie für den neuen Vertrag an:", reply_markup=reply_markup)
     return SETCATEGORY
@@ -144,15 +172,11 @@ async def alerting(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await query.answer()
     chat_id = update.effective_message.chat_id
     try:
-        myhour = 7
-        mytime = time(hour = myhour, minute = 20, second = 0)
-    
-        if (context.job_queue.get_jobs_by_name("Alerts-"+str(chat_id))):
+        if (chat_id in alertChats(context)):
             text = "Erinnerungen sind bereits aktiv."
         else:
-            text = "Erinnerungen werden von jetzt an täglich um "+str(myhour+2)+" gesendet!"
-            #context.job_queue.run_repeating(sendAlert, 10, first=5, last=None, data=None, name="Alerts", chat_id=chat_id, user_id=None, job_kwargs=None)
-            context.job_queue.run_daily(sendAlert, mytime, chat_id=chat_id, name="Alerts-"+str(chat_id), job_kwargs=None)
+            text = "Erinnerungen werden von jetzt an täglich um "+str(alertTime.hour+2)+" gesendet!"
+            alertChats(context)[chat_id] = update.effective_user.id
 
         await update.effective_message.reply_text(text)
         return ConversationHandler.END
@@ -167,8 +191,8 @@ async def stopAlerts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     chat_id = update.effective_message.chat_id
     try:
            
-        if (context.job_queue.get_jobs_by_name("Alerts-"+str(chat_id))):
-            context.job_queue.get_jobs_by_name("Alerts-"+str(chat_id))[0].schedule_removal()
+        if (chat_id in alertChats(context)):
+            del alertChats(context)[chat_id]
             text = "Erinnerungen wurden deaktiviert."
         else:
             text = "Es wurden keine Erinnerungen gefunden....das ist seltsam :/"
@@ -184,27 +208,14 @@ async def showcontract(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     """Nutzer soll die Vertrags Kategorie wählen"""
     query = update.callback_query
     await query.answer()
-    keyboard = []
-    categories = []
-    categories = contract_dbqueries.getActiveContractCategories()
-    for c in categories:
-        keyboard.append([InlineKeyboardButton(c[1], callback_data=c[0])])
-    keyboard.append([InlineKeyboardButton("\U000025C0 zurück", callback_data="back")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup, _ = await activeCategoryKeyboard.firstPage(context, update.effective_user.id)
     await query.edit_message_text("Ich kann dich über deine laufenden Verträge informieren. Folgende Kategorien von Verträgen gibt es:", reply_markup=reply_markup)
     return CATEGORY
 
 async def startover(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
-    keyboard = []
-    categories = []
-    categories = contract_dbqueries.getActiveContractCategories()
-
-    for c in categories:
-        keyboard.append([InlineKeyboardButton(c[1], callback_data=c[0])])
-    keyboard.append([InlineKeyboardButton("zurück", callback_data="back")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup, _ = await activeCategoryKeyboard.firstPage(context, update.effective_user.id)
 
     await query.edit_message_text("Folgende Kategorien habe ich gefunden:", reply_markup=reply_markup)
     return CATEGORY
@@ -217,12 +228,12 @@ async def category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     print("Kategorie: "+answer)
     keyboard = []
     types = []
-    types = contract_dbqueries.getContractTypes(answer)
+    types = await contract_dbqueries_async.getContractTypes(answer)
     for items in types:
         print(items)
     
     for t in types:
-        keyboard.append([InlineKeyboardButton(t[1], callback_data=t[0])])
+        keyboard.append([InlineKeyboardButton(t.contract_type, callback_data=str(t.contract_type_id))])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(
@@ -236,12 +247,13 @@ async def setcategory(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     await query.answer()
     answer = query.data
     context.user_data["category"] = answer
+    context.user_data.pop("newCategoryName", None)
     keyboard = []
     types = []
-    types = contract_dbqueries.getContractTypes(answer)
+    types = await contract_dbqueries_async.getContractTypes(answer)
     
     for t in types:
-        keyboard.append([InlineKeyboardButton(t[1], callback_data=t[0])])
+        keyboard.append([InlineKeyboardButton(t.contract_type, callback_data=str(t.contract_type_id))])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(
@@ -261,9 +273,10 @@ async def newcategory(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 async def savecategory(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Neue Vertragskategorie soll gespeichert werden werden."""
     message = update.message
-    newCategory = contract_dbqueries.newCategory(message.text)
-    context.user_data["category"] = newCategory[0]
-    logger.info("New Category saved: " +str(newCategory[0]) +" - "+message.text)
+    # wird erst zusammen mit dem Vertrag gespeichert (saveContract)
+    context.user_data["newCategoryName"] = message.text
+    context.user_data["category"] = None
+    logger.info("New Category: "+message.text)
     await update.message.reply_text(
         text="Alles klar! Die Kategorie \"" + message.text + "\" wurde angelegt. Welche Vertragsart möchtest du zur neuen Kategorie anlegen?"
     )
@@ -272,16 +285,17 @@ async def savecategory(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 async def savetype(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Neue Vertragsart soll gespeichert werden."""
     message = update.message
-    newType = contract_dbqueries.newType(context.user_data["category"], message.text)
-    context.user_data["type"] = newType[0]
-    logger.info("New Type saved: " +str(newType) +" - "+message.text)
+    # wird erst zusammen mit dem Vertrag gespeichert (saveContract)
+    context.user_data["newTypeName"] = message.text
+    context.user_data["type"] = None
+    logger.info("New Type: "+message.text)
     keyboard = []
     beneficiaries = []
-    beneficiaries = contract_dbqueries.getBeneficiaries()
+    beneficiaries = await contract_dbqueries_async.getBeneficiaries(update.effective_user.id)
 
     for t in beneficiaries:
-        buttonlabel = str(t[0])
-        keyboard.append([InlineKeyboardButton(buttonlabel, callback_data=t[1])])
+        buttonlabel = str(t.name)
+        keyboard.append([InlineKeyboardButton(buttonlabel, callback_data=str(t.id))])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(
         text="Alles klar! Die Vertragsart \"" + message.text + "\" wurde angelegt.\nWer ist der Vertragsnehmer?" , reply_markup=reply_markup
@@ -294,19 +308,14 @@ async def type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await query.answer()
     answer = query.data
     keyboard = []
-    types = []
-    contracts = contract_dbqueries.getContracts(answer)
-    if (len(contracts) == 0 ):
+    reply_markup, contractCount = await contractKeyboard.firstPage(context, update.effective_user.id, answer)
+    if (contractCount == 0 ):
         keyboard.append([InlineKeyboardButton("OK", callback_data=answer)])
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text(
         text="Für diese Vertragsart gibt es noch keine Verträge. Wähle eine andere Art.", reply_markup=reply_markup)
         return START
 
-    for t in contracts:
-        buttonlabel = str(t[18]) + " bei " + str(t[21])
-        keyboard.append([InlineKeyboardButton(buttonlabel, callback_data=t[1])])
-    reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(
         text="Folgende Verträge habe ich gefunden:", reply_markup=reply_markup
     )
@@ -318,13 +327,14 @@ async def settype(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await query.answer()
     answer = query.data
     context.user_data["type"] = answer
+    context.user_data.pop("newTypeName", None)
     keyboard = []
     beneficiaries = []
-    beneficiaries = contract_dbqueries.getBeneficiaries()
+    beneficiaries = await contract_dbqueries_async.getBeneficiaries(update.effective_user.id)
 
     for t in beneficiaries:
-        buttonlabel = str(t[0])
-        keyboard.append([InlineKeyboardButton(buttonlabel, callback_data=t[1])])
+        buttonlabel = str(t.name)
+        keyboard.append([InlineKeyboardButton(buttonlabel, callback_data=str(t.id))])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(
         text="Wer ist der Vertragsnehmer?", reply_markup=reply_markup
@@ -337,13 +347,7 @@ async def setbeneficiary(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await query.answer()
     answer = query.data
     context.user_data["beneficiary"] = answer
-    keyboard = []
-    contractors = []
-    contractors = contract_dbqueries.getContractors()
-    for t in contractors:
-        buttonlabel = str(t[1])
-        keyboard.append([InlineKeyboardButton(buttonlabel, callback_data=t[0])])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup, _ = await contractorKeyboard.firstPage(context)
     await query.edit_message_text(
         text="Wer ist der Anbieter?", reply_markup=reply_markup
     )
@@ -370,10 +374,10 @@ async def setfee(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data["fee"] = message.text
     keyboard = []
     periods = []
-    periods = contract_dbqueries.getPeriods()
+    periods = await contract_dbqueries_async.getPeriods()
     for t in periods:
-        buttonlabel = str(t[0])
-        keyboard.append([InlineKeyboardButton(buttonlabel, callback_data=t[1])])
+        buttonlabel = str(t.period_name)
+        keyboard.append([InlineKeyboardButton(buttonlabel, callback_data=str(t.period_id))])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(
         text="In welchem Turnus bezahlst du?", reply_markup=reply_markup
@@ -399,10 +403,10 @@ async def setaccount(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data["period"] = answer
     keyboard = []
     accounts = []
-    accounts = contract_dbqueries.getAccounts()
+    accounts = await contract_dbqueries_async.getAccounts(update.effective_user.id)
     for t in accounts:
-        buttonlabel = str(t[1])
-        keyboard.append([InlineKeyboardButton(buttonlabel, callback_data=t[0])])
+        buttonlabel = str(t.account_IBAN)
+        keyboard.append([InlineKeyboardButton(buttonlabel, callback_data=str(t.account_id))])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(
         text="Bitte gib das Konto für die Zahlung an!", reply_markup=reply_markup
@@ -444,7 +448,7 @@ async def setstartdate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
 async def setEndDate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     message = update.message
-    context.user_data["startdate"] = makeValidDateString(message.text)
+    context.user_data["startdate"] = await makeValidDateString(message.text)
     await update.message.reply_text(
         text="Wann ist das Ende des Vertrags? z.B. 31.12.2024"
     )
@@ -458,15 +462,17 @@ async def setEndDateAgain(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def saveContract(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     message = update.message
-    context.user_data["enddate"] = makeValidDateString(message.text)
+    context.user_data["enddate"] = await makeValidDateString(message.text)
     enddate = datetime.strptime(context.user_data["enddate"], '%Y-%m-%d').date()
     nextcanceldate = enddate - relativedelta(months=+int(context.user_data["noticeperiod"])) 
     context.user_data["nextcancellationdate"] = nextcanceldate
     context.user_data["userid"] = context._user_id
-    newContract = contract_dbqueries.saveContract(context.user_data)
+    newContract = await contract_dbqueries_async.saveContract(context.user_data)
     for x in newContract:
         print(x)
     context.user_data["last_inserted_contract"] = newContract[0]
+    context.user_data.pop("newCategoryName", None)
+    context.user_data.pop("newTypeName", None)
 
     keyboard = []
     keyboard.append([InlineKeyboardButton("ja", callback_data="activate_alerting")])
@@ -489,7 +495,7 @@ async def activateContractAlerting(update: Update, context: ContextTypes.DEFAULT
     await query.answer()
     
     if (query.data == "activate_alerting"):
-        contract_dbqueries.setContractAlertingStatus(context.user_data["last_inserted_contract"], 1)
+        await contract_dbqueries_async.setContractAlertingStatus(update.effective_user.id, context.user_data["last_inserted_contract"], 1)
         await query.edit_message_text(
             text="Super, der Vertragswecker wurde aktiviert \U0001F44D. Du wirst rechtzeitig von mir informiert, sobald dein Vertrag ausläuft. Bis später!"
         )
@@ -501,6 +507,33 @@ async def activateContractAlerting(update: Update, context: ContextTypes.DEFAULT
 
     return ConversationHandler.END
 
+def renderContractView(userId, contract) -> ContractView:
+    head = ("Folgende Infos gibt es zum Vertrag:\n"
+            +"\n *Typ:* "+str(contract.contract_type)+"\n"
+            +"\n *Kosten:* "+str(contract.contract_fee)+"€"+"\n"
+            +"\n *Für:* "+str(contract.name)+"\n"
+            +"\n *Anbieter:* "+str(contract.contractor_name)+"\n"
+            +"\n *Zahlung:* "+str(contract.period_name)+"\n"
+            +"\n *Kündigung bis:* "+str(contract.contract_next_cancellation_date)+" (noch ")
+    tail = (" Tage!)"+"\n"
+            +"\n *Konto:* "+str(contract.account_IBAN))
+    return ContractView(userId, contract.contract_id, contract.contract_next_cancellation_date, head, tail)
+
+async def contractView(userId, contractId):
+    """Detail screen of one of the user's contracts, None if there is no such contract.
+    Views are cached (contract_cache.contractViews), only the first view of a contract costs a query."""
+    key = contract_cache.makeKey(contractId)
+    found, view = contract_cache.contractViews.get(key)
+    if not found:
+        contract = await contract_dbqueries_async.getContractById(userId, contractId)
+        if contract is None:
+            return None
+        view = renderContractView(userId, contract)
+        contract_cache.contractViews.set(key, view)
+    if view.user_id != userId:
+        return None
+    return view
+
 async def contract(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Zeige die Vertragsdetails für einen spezifischen Vertrag"""
     query = update.callback_query
@@ -510,23 +543,22 @@ async def contract(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     keyboard.append([InlineKeyboardButton("OK, Danke!", callback_data="end")])
     keyboard.append([InlineKeyboardButton("Vertrag löschen", callback_data="delete-"+str(answer))])
     
-    contract = contract_dbqueries.getContractById(int(answer))
-    for items in contract:
-            print(items)
+    contract = await contractView(update.effective_user.id, int(answer))
+    if contract is None:
+        await query.edit_message_text(text="Diesen Vertrag gibt es nicht (mehr).")
+        return ConversationHandler.END
     today = datetime.now().date()
-    canceldate = contract[7]
+    canceldate = contract.contract_next_cancellation_date
     delta =  canceldate - today
     daystocancel = str(delta.days)
+    dueSoon = ""
+    if dueIndex.ready:
+        others = [c for c in dueIndex.dueWithin(today, max(alertMilestones), [update.effective_user.id]) if c.contract_id != contract.contract_id]
+        if others:
+            dueSoon = "\n\n_In den nächsten "+str(max(alertMilestones))+" Tagen kannst du noch "+str(len(others))+" weitere(n) Vertrag/Verträge kündigen._"
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(
-        text="Folgende Infos gibt es zum Vertrag:\n"
-                                            +"\n *Typ:* "+str(contract[5])+"\n"
-                                            +"\n *Kosten:* "+str(contract[1])+"€"+"\n"
-                                            +"\n *Für:* "+str(contract[2])+"\n"
-                                            +"\n *Anbieter:* "+str(contract[4])+"\n"
-                                            +"\n *Zahlung:* "+str(contract[3])+"\n"
-                                            +"\n *Kündigung bis:* "+str(contract[7])+" (noch "+daystocancel+" Tage!)"+"\n"
-                                            +"\n *Konto:* "+str(contract[6]), reply_markup=reply_markup, parse_mode= 'Markdown'
+        text=contract.head+daystocancel+contract.tail+dueSoon, reply_markup=reply_markup, parse_mode= 'Markdown'
     )
     return DETAILS
 
@@ -553,7 +585,7 @@ async def reallyDeleteContract(update: Update, context: ContextTypes.DEFAULT_TYP
     keyboard = []
     keyboard.append([InlineKeyboardButton("OK, Danke!", callback_data="end")])
 
-    contract_dbqueries.deleteContractById(int(answer))
+    await contract_dbqueries_async.deleteContractById(update.effective_user.id, int(answer))
     await query.edit_message_text(
         text="Vertrag wurde gelöscht.\n Bis später!"
     )
@@ -571,7 +603,7 @@ async def editcontract(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     types = []
     
     
-    contract = contract_dbqueries.getContractById(int(answer))
+    contract = await contract_dbqueries_async.getContractById(update.effective_user.id, int(answer))
    
    
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -589,18 +621,138 @@ async def end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await query.edit_message_text(text="Alles klar, bis später!")
     return ConversationHandler.END
 
+def renderAlertDigest(contracts) -> list:
+    """Render all due contracts of a chat into as few Markdown messages as Telegram's length limit allows.
+    contracts are DueContract rows; they are listed by days remaining.
+    Returns (text, contracts listed in it) per message."""
+    header = "Dies ist eine Erinnerung! Folgende Verträge verlängern sich bald automatisch:\n"
+    footer = "\nVergiss nicht, zu kündigen!"
+    messages = []
+    text = header
+    listed = []
+    for c in sorted(contracts, key=lambda c: c.days_left):
+        line = "\n\u2022 *"+str(c.contract_type)+"* bei "+str(c.contractor_name)+": in "+str(c.days_left)+" Tag(en) um "+str(c.contract_renewal_period_months)+" Monat(e)"
+        if len(text) + len(line) + len(footer) > MessageLimit.MAX_TEXT_LENGTH:
+            messages.append((text, listed))
+            text = line.lstrip("\n")
+            listed = []
+        else:
+            text += line
+        listed.append(c)
+    messages.append((text + footer, listed))
+    return messages
+
 async def sendAlert(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Sende den Alert."""
-    job = context.job
+    """Sende die Alerts an alle Chats, die Erinnerungen aktiviert haben (ein Job, eine Abfrage)."""
+    subscriptions = dict(alertChats(context))
+    if not subscriptions:
+        return
+    chatsByUser = {}
+    for chat_id, userId in subscriptions.items():
+        chatsByUser.setdefault(userId, []).append(chat_id)
+
     today = datetime.now().date()
-    contracts = contract_dbqueries.getAllContracts()
+    # contracts_datechecker renews contracts in its own process, so reload the index once a day
+    if dueIndex.loadedOn != today:
+        await contract_dbqueries_async.warmDueIndex(today)
+    contracts = dueIndex.dueContracts(list(chatsByUser), today, alertMilestones)
+    contractsByUser = {}
     for c in contracts:
-        canceldate = c[6]
-        delta = canceldate - today
-        if (delta.days <= 14):
-            await context.bot.send_message(job.chat_id, parse_mode= 'Markdown', text=f"Dies ist eine Erinnerung!\nDein Vertrag: *"+str(c[17])+"* bei "+str(c[20])+" verlängert sich in "+str(delta.days)+" Tag(en) automatisch um "+str(c[15])+" Monat(e).\nVergiss nicht, zu kündigen!")
+        contractsByUser.setdefault(c.user_id, []).append(c)
+
+    notified = []
+    for userId, userContracts in contractsByUser.items():
+        if alertDigestMode:
+            messages = renderAlertDigest(userContracts)
+        else:
+            messages = [("Dies ist eine Erinnerung!\nDein Vertrag: *"+str(c.contract_type)+"* bei "+str(c.contractor_name)+" verlängert sich in "+str(c.days_left)+" Tag(en) automatisch um "+str(c.contract_renewal_period_months)+" Monat(e).\nVergiss nicht, zu kündigen!", [c]) for c in userContracts]
+        # messages that reached at least one chat of the user; only their contracts count as reminded
+        delivered = set()
+        for chat_id in chatsByUser.get(userId, []):
+            for i, (text, _) in enumerate(messages):
+                try:
+                    await context.bot.send_message(chat_id, parse_mode= 'Markdown', text=text)
+                    delivered.add(i)
+                except RetryAfter:
+                    # the rate limiter gave up on this message, carry on with the others
+                    logger.warning("Reminder to chat "+str(chat_id)+" dropped")
+                except TelegramError as e:
+                    # blocked bot, deleted chat, broken Markdown ...: skip this chat, the others still get their reminders
+                    logger.warning("Reminder to chat "+str(chat_id)+" failed: "+str(e))
+                    break
+        notified += [(c.contract_id, c.milestone) for i in sorted(delivered) for c in messages[i][1]]
+
+    if notified:
+        await contract_dbqueries_async.markContractsNotified(notified, today)
 
     
+async def exportContracts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Sende alle Verträge des Nutzers als Datei: /export [csv|jsonl]"""
+    userId = update.effective_user.id
+    if not (await contract_dbqueries_async.isAuthorized(userId)):
+        await update.message.reply_text("Sorry, du bist nicht berechtigt!")
+        return
+    format = context.args[0].lower() if context.args else "csv"
+    if format not in contract_export.formats:
+        await update.message.reply_text("Dieses Format kenne ich nicht. Möglich sind: " + ", ".join(contract_export.formats))
+        return
+
+    # the rows are streamed into a temporary file, never held in memory as a whole
+    fd, path = tempfile.mkstemp(suffix="." + format)
+    os.close(fd)
+    try:
+        count = await contract_dbqueries_async.runQuery(contract_export.exportToFile, userId, path, format)
+        if count == 0:
+            await update.message.reply_text("Du hast noch keine Verträge.")
+            return
+        with open(path, "rb") as document:
+            await update.message.reply_document(document=document, filename="vertraege." + format, caption=str(count) + " Verträge")
+    finally:
+        os.remove(path)
+
+async def forecast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Zeige Kosten und Termine der aktiven Verträge für die nächsten Monate (/forecast)."""
+    userId = update.effective_user.id
+    if not (await contract_dbqueries_async.isAuthorized(userId)):
+        await update.message.reply_text("Sorry, du bist nicht berechtigt!")
+        return
+    contracts = await contract_dbqueries_async.getForecastContracts(userId)
+    if not contracts:
+        await update.message.reply_text("Du hast noch keine aktiven Verträge.")
+        return
+    text = contract_forecast.formatForecast(contract_forecast.forecast(contracts, datetime.now().date()))
+    if len(text) <= MessageLimit.MAX_TEXT_LENGTH:
+        await update.message.reply_text(text)
+    else:
+        await update.message.reply_document(document=io.BytesIO(text.encode("utf-8")), filename="prognose.txt",
+                                            caption=text.split("\n", 1)[0])
+
+async def importDocument(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Importiere die Verträge aus einer hochgeladenen CSV-Datei (Spalten siehe contract_import)."""
+    userId = update.effective_user.id
+    if not (await contract_dbqueries_async.isAuthorized(userId)):
+        await update.message.reply_text("Sorry, du bist nicht berechtigt!")
+        return
+    document = update.message.document
+    if document.file_size and document.file_size > importMaxBytes:
+        await update.message.reply_text("Die Datei ist zu groß, es gehen höchstens " + str(importMaxBytes // 1024) + " KB.")
+        return
+    data = await (await document.get_file()).download_as_bytearray()
+    try:
+        text = bytes(data).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        await update.message.reply_text("Die Datei muss UTF-8 kodiert sein.")
+        return
+
+    await update.effective_chat.send_action("typing")
+    report = await contract_dbqueries_async.runQuery(contract_import.importContracts, userId, text)
+    reportText = contract_import.formatReport(report)
+    if len(reportText) <= MessageLimit.MAX_TEXT_LENGTH:
+        await update.message.reply_text(reportText)
+    else:
+        await update.message.reply_document(document=io.BytesIO(reportText.encode("utf-8")), filename="import_bericht.txt",
+                                            caption=reportText.split("\n", 2)[0] + " " + str(len(report.errors)) + " Zeile(n) mit Fehlern.")
+
 async def validateUserInput(input: str, inputType : UserInputType) -> bool:
     """validate user input based on input type provided."""
     regEx = userInputRegexMap[inputType]
@@ -611,11 +763,23 @@ async def validateUserInput(input: str, inputType : UserInputType) -> bool:
         return False
 
 
-def main() -> None:
-    """Run the bot."""
-    # Create the Application and pass it your bot's token.
-    application = Application.builder().token("5639687161:AAFg8NO8kOcHQmFODEKA8SZSshQv4fiqQHg").build()
-  
+async def warmDueIndex(application: Application) -> None:
+    """Load the due-date index before the first update is handled."""
+    count = await contract_dbqueries_async.warmDueIndex()
+    logger.info("Due-date index loaded with "+str(count)+" contracts")
+
+async def shutdownDatabase(application: Application) -> None:
+    """Wait for running queries and stop the query executor."""
+    contract_dbqueries_async.shutdown()
+
+
+def instrument(callback, state: str):
+    """Time callback in metrics and name it as the cause of its queries in the slow-query log."""
+    return metrics.timedCallback(slow_query_log.tracked(callback, state + ":" + callback.__name__), state)
+
+def buildConversationHandler() -> ConversationHandler:
+    """The conversation of the bot, from /start to the last answer of every flow.
+    Every callback is instrumented, labelled by the stage it runs in."""
     conv_handler = ConversationHandler(
         entry_points=
             [CommandHandler("start", start)],
@@ -637,11 +801,13 @@ def main() -> None:
             ],
             CATEGORY: [
                 CallbackQueryHandler(start, pattern="^back$"),
+                CallbackQueryHandler(turnPage, pattern=pagePattern),
                 CallbackQueryHandler(category, pattern="^.+$")
                 
             ],
             SETCATEGORY: [
                 CallbackQueryHandler(newcategory, pattern="^new_category$"),
+                CallbackQueryHandler(turnPage, pattern=pagePattern),
                 CallbackQueryHandler(setcategory, pattern="^.+$")                
             ],
             NEWCATEGORY: [
@@ -660,6 +826,7 @@ def main() -> None:
                 CallbackQueryHandler(setbeneficiary, pattern="^.+$")
             ],
             SETCONTRACTOR: [
+                CallbackQueryHandler(turnPage, pattern=pagePattern),
                 CallbackQueryHandler(setcontractor, pattern="^.+$"),
                 MessageHandler(filters.Regex("^$"), setfee)
             ],
@@ -691,6 +858,7 @@ def main() -> None:
                 CallbackQueryHandler(setaccount, pattern="^.+$")
             ],
             CONTRACT: [
+                CallbackQueryHandler(turnPage, pattern=pagePattern),
                 CallbackQueryHandler(contract, pattern="^.+$")
             ],
             REALLYDELETE: [
@@ -708,12 +876,72 @@ def main() -> None:
         },
         fallbacks=[CommandHandler("start", start)],
     )
-
+    for handler in conv_handler.entry_points:
+        handler.callback = instrument(handler.callback, "entry")
+    for state, handlers in conv_handler.states.items():
+        for handler in handlers:
+            handler.callback = instrument(handler.callback, stageNames[state])
+    for handler in conv_handler.fallbacks:
+        handler.callback = instrument(handler.callback, "fallback")
+    return conv_handler
+
+def addGauges(application: Application) -> None:
+    """Expose pool, cache, rate limiter and due-date index figures on the metrics endpoint."""
+    metrics.Gauge("contracts_db_pool", "Connection pool and prepared statement figures", ["stat"],
+                  lambda: {(k,): v for k, v in contract_dbqueries_async.getPoolStats().items()})
+    metrics.Gauge("contracts_cache", "Query cache figures", ["cache", "stat"],
+                  lambda: {(name, k): v for name, stats in contract_cache.getCacheStats().items() for k, v in stats.items()})
+    metrics.Gauge("contracts_due_index_contracts", "Contracts in the due-date index", [],
+                  lambda: {(): dueIndex.stats()["contracts"]})
+    rateLimiter = application.bot.rate_limiter
+    if isinstance(rateLimiter, MessageRateLimiter):
+        metrics.Gauge("contracts_telegram_requests", "Requests in the rate limiter", ["stat"],
+                      lambda: {(k,): v for k, v in rateLimiter.getMetrics().items()})
+
+def addHandlers(application: Application) -> None:
+    """Register all update handlers of the bot at application."""
+    # Reject known unauthorized users before the conversation is even looked at
+    application.add_handler(TypeHandler(Update, rejectUnauthorized), group=-1)
+    # Commands outside the conversation, registered first so a running conversation does not take them as input
+    application.add_handler(CommandHandler("export", instrument(exportContracts, "command")))
+    application.add_handler(CommandHandler("forecast", instrument(forecast, "command")))
+    application.add_handler(MessageHandler(filters.Document.FileExtension("csv"), instrument(importDocument, "command")))
     # Add ConversationHandler to application that will be used for handling updates
-    application.add_handler(conv_handler)
+    application.add_handler(buildConversationHandler())
+
+
+def main() -> None:
+    """Run the bot."""
+    parser = argparse.ArgumentParser(description="Vertrags-Bot")
+    parser.add_argument("--webhook", action="store_true", help="receive updates via webhook instead of long polling")
+    parser.add_argument("--listen", default="127.0.0.1", help="address of the webhook server")
+    parser.add_argument("--port", type=int, default=8080, help="port of the webhook server")
+    parser.add_argument("--url", help="public base URL registered at Telegram; leave out to test locally by POSTing updates")
+    parser.add_argument("--secret", help="secret token Telegram sends with every webhook request; generated if --url is given without it")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of updates processed concurrently (in order per chat)")
+    parser.add_argument("--metrics-port", type=int, default=9464, help="port of the local Prometheus metrics endpoint, 0 to switch it off")
+    parser.add_argument("--slow-query-ms", type=float, default=200, help="log statements taking at least this many milliseconds, 0 to switch the log off")
+    parser.add_argument("--slow-query-log", default="slow_queries.log", help="file of the slow-query log (rotated)")
+    args = parser.parse_args()
+
+    # Create the Application and pass it your bot's token.
+    application = (Application.builder().token("5639687161:AAFg8NO8kOcHQmFODEKA8SZSshQv4fiqQHg")
+                   .concurrent_updates(ChatOrderedUpdateProcessor(args.concurrency))
+                   .rate_limiter(MessageRateLimiter()).post_init(warmDueIndex).post_shutdown(shutdownDatabase).build())
+    addHandlers(application)
+    # One reminder job for all chats, see alertChats()
+    application.job_queue.run_daily(metrics.timedJob(slow_query_log.tracked(sendAlert, "job:sendAlert")), alertTime, name="Alerts", job_kwargs=None)
+    if args.slow_query_ms:
+        slow_query_log.configure(args.slow_query_log, args.slow_query_ms / 1000)
+    if args.metrics_port:
+        addGauges(application)
+        metrics.startServer(args.metrics_port)
 
     # Run the bot until the user presses Ctrl-C
-    application.run_polling()
+    if args.webhook:
+        asyncio.run(webhook_server.runWebhook(application, args.listen, args.port, args.url, args.secret))
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
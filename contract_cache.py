@@ -0,0 +1,146 @@
+"""In-process TTL cache for query results that rarely change.
+
+Every cache has a name (usually the name of the cached query function), a time to live and
+a maximum number of entries. Entries are keyed by the query arguments converted to strings,
+so getContractTypes(3) and getContractTypes("3") share one entry.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+defaultTTL = 600
+defaultMaxSize = 128
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds."""
+
+    def __init__(self, name: str, ttl: float = defaultTTL, maxSize: int = defaultMaxSize):
+        self.name = name
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (True, value) for a live entry, (False, None) otherwise."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None) -> None:
+        """Drop one entry, or all entries if no key is given."""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.maxSize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+caches = {}
+cachesLock = threading.Lock()
+
+def getCache(name: str, ttl: float = defaultTTL, maxSize: int = defaultMaxSize) -> TTLCache:
+    """Return the cache registered under name, creating it on first use."""
+    with cachesLock:
+        if name not in caches:
+            caches[name] = TTLCache(name, ttl, maxSize)
+        return caches[name]
+
+def makeKey(*args) -> tuple:
+    return tuple(str(a) for a in args)
+
+def cachedQuery(ttl: float = defaultTTL, maxSize: int = defaultMaxSize):
+    """Cache the results of a query function in a cache named after the function."""
+    def decorator(func):
+        cache = getCache(func.__name__, ttl, maxSize)
+        @wraps(func)
+        def inner(*args):
+            key = makeKey(*args)
+            found, value = cache.get(key)
+            if found:
+                return value
+            value = func(*args)
+            cache.set(key, value)
+            return value
+        return inner
+    return decorator
+
+def invalidate(name: str, *args) -> None:
+    """Drop the entry of cache name for the given query arguments, or the whole cache if no arguments are given."""
+    cache = caches.get(name)
+    if cache is not None:
+        cache.invalidate(makeKey(*args) if args else None)
+
+
+class AuthorizationCache:
+    """Remembers which Telegram users are allowed to use the bot and which are not.
+    Denied users are kept longer, so repeated messages from strangers never reach the database."""
+
+    def __init__(self, allowTTL: float = 900, denyTTL: float = 3600, maxSize: int = 10000):
+        self.allowed = getCache("authorizedUsers", allowTTL, maxSize)
+        self.denied = getCache("unauthorizedUsers", denyTTL, maxSize)
+
+    def lookup(self, userId):
+        """True/False for a cached decision, None if the user has to be checked against the database."""
+        key = makeKey(userId)
+        if self.denied.get(key)[0]:
+            return False
+        if self.allowed.get(key)[0]:
+            return True
+        return None
+
+    def remember(self, userId, allowed: bool) -> None:
+        key = makeKey(userId)
+        if allowed:
+            self.denied.invalidate(key)
+            self.allowed.set(key, True)
+        else:
+            self.allowed.invalidate(key)
+            self.denied.set(key, True)
+
+    def invalidate(self, userId=None) -> None:
+        """Forget the decision for one user (e.g. after adding or removing them), or for everyone."""
+        key = makeKey(userId) if userId is not None else None
+        self.allowed.invalidate(key)
+        self.denied.invalidate(key)
+
+
+authorization = AuthorizationCache()
+
+# rendered contract detail screens by contract id, dropped by the write functions of contract_dbqueries
+contractViews = getCache("contractViews", 3600, 2048)
+
+def getCacheStats() -> dict:
+    with cachesLock:
+        return {name: cache.stats() for name, cache in caches.items()}
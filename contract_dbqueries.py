@@ -1,134 +1,538 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from contextlib import contextmanager
+from functools import wraps
 import mysql.connector
+from mysql.connector import pooling
 import dbcredentials
+import contract_cache
+import metrics
+import slow_query_log
+from contract_dueindex import dueIndex
+from contract_rows import (Category, ContractType, Beneficiary, Contractor, Period, Account, ContractListItem,
+                           Contract, ContractDetails, RenewalCandidate, DueContract, IndexedContract, ExportRow,
+                           ForecastContract)
+
+# Fixed number of connections kept open to the database
+poolName = "contracts"
+poolSize = 5
+# Seconds a query waits for a free connection before giving up
+poolTimeout = 10
+# Prepared statements kept open per pooled connection
+statementCacheSize = 32
+
+pool = None
+poolLock = threading.Lock()
+poolSlots = threading.BoundedSemaphore(poolSize)
+poolStats = {
+    "in_use": 0,
+    "borrowed": 0,
+    "timeouts": 0,
+    "wait_time_total": 0.0,
+    "wait_time_max": 0.0,
+    "statements_prepared": 0,
+    "statements_reused": 0,
+}
 
 def queryWrapper(func):
+    """Borrow a pooled connection for the duration of the query and pass a fresh cursor
+    as first argument. Cursor and connection are always handed back, even on errors."""
+    @wraps(func)
     def inner(*args,**kwargs):
-        global conn
-        global cur
         conn = getConnection()
-        cur = getSQLCursor(conn)
-        return func(*args,**kwargs)
-    return inner 
-      
+        try:
+            cur = getSQLCursor(conn, func.__name__)
+            try:
+                return func(cur, *args, **kwargs)
+            finally:
+                cur.close()
+        finally:
+            releaseConnection(conn)
+    return metrics.timedQuery(inner)
+
+def transactionWrapper(func):
+    """Like queryWrapper, but runs the query function inside one transaction (see unitOfWork).
+    Commits when the function returns and rolls back if it raises."""
+    @wraps(func)
+    def inner(*args,**kwargs):
+        with unitOfWork(func.__name__) as uow:
+            return func(uow.cur, *args, **kwargs)
+    return metrics.timedQuery(inner)
+
+
+class UnitOfWork:
+    """Several statements on one pooled connection that are committed or rolled back together."""
+
+    def __init__(self, conn, queryName=None):
+        self.conn = conn
+        self.cur = getSQLCursor(conn, queryName)
+        self.callbacks = []
+
+    def execute(self, sql, params=()):
+        self.cur.execute(sql, params)
+        return self.cur
+
+    def executemany(self, sql, seqParams):
+        self.cur.executemany(sql, seqParams)
+        return self.cur
+
+    def insert(self, sql, params=()) -> int:
+        """Run an INSERT and return the generated key, without an extra SELECT."""
+        self.cur.execute(sql, params)
+        return self.cur.lastrowid
+
+    def insertMany(self, sql, seqParams) -> int:
+        """Insert all rows with one multi-row INSERT and return the number of rows.
+        Uses a plain cursor, whose executemany the connector rewrites into a single statement."""
+        cur = self.conn.cursor()
+        try:
+            cur.executemany(sql, seqParams)
+            return cur.rowcount
+        finally:
+            cur.close()
+
+    def afterCommit(self, callback) -> None:
+        """Run callback once the transaction is committed, e.g. to invalidate caches."""
+        self.callbacks.append(callback)
+
+@contextmanager
+def unitOfWork(queryName=None):
+    """Open a transaction on a pooled connection:
+
+        with contract_dbqueries.unitOfWork() as uow:
+            categoryId = uow.insert("INSERT INTO contract_categories ...", (...))
+            ...
+
+    Commits when the block ends, rolls back and re-raises if it raises.
+    queryName names the statements in the slow-query log."""
+    conn = getConnection()
+    try:
+        conn.start_transaction()
+        uow = UnitOfWork(conn, queryName)
+        try:
+            yield uow
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            uow.cur.close()
+    finally:
+        releaseConnection(conn)
+    for callback in uow.callbacks:
+        callback()
+
+
+def getPool():
+    """Create the connection pool on first use."""
+    global pool
+    with poolLock:
+        if pool is None:
+            try:
+                pool = pooling.MySQLConnectionPool(
+                    pool_name=poolName,
+                    pool_size=poolSize,
+                    # resetting the session would deallocate the cached prepared statements
+                    pool_reset_session=False,
+                    user=dbcredentials.user,
+                    password=dbcredentials.password,
+                    host=dbcredentials.host,
+                    port=dbcredentials.port,
+                    database=dbcredentials.database,
+                    autocommit = True)
+            except mysql.connector.Error as e:
+                print(f"Error creating mysql.connector pool: {e}")
+                raise
+    return pool
 
 def getConnection():
+    """Borrow a connection from the pool, waiting up to poolTimeout seconds for a free one.
+    The pool checks the connection and reconnects it if the server dropped it."""
+    waitStart = time.perf_counter()
+    if not poolSlots.acquire(timeout=poolTimeout):
+        with poolLock:
+            poolStats["timeouts"] += 1
+        raise pooling.PoolError("No free database connection after "+str(poolTimeout)+"s")
+    waited = time.perf_counter() - waitStart
     try:
-       conn = mysql.connector.connect(
-          user=dbcredentials.user,
-          password=dbcredentials.password,
-          host=dbcredentials.host,
-          port=dbcredentials.port,
-          database=dbcredentials.database,
-          autocommit = True)
+        conn = getPool().get_connection()
     except mysql.connector.Error as e:
-       print(f"Error connecting to mysql.connector Platform: {e}")
+        poolSlots.release()
+        print(f"Error connecting to mysql.connector Platform: {e}")
+        raise
 
+    with poolLock:
+        poolStats["in_use"] += 1
+        poolStats["borrowed"] += 1
+        poolStats["wait_time_total"] += waited
+        poolStats["wait_time_max"] = max(poolStats["wait_time_max"], waited)
     return conn
 
-def getSQLCursor(conn):
-    cur = conn.cursor()
+def releaseConnection(conn):
+    """Hand a borrowed connection back to the pool."""
+    try:
+        conn.close()
+    except mysql.connector.Error as e:
+        print(f"Error returning connection to pool: {e}")
+    finally:
+        with poolLock:
+            poolStats["in_use"] -= 1
+        poolSlots.release()
+
+class PreparedCursor:
+    """Cursor handed to the query functions.
+
+    Every distinct SQL text is executed through its own server-side prepared statement. The prepared
+    cursors are cached on the pooled connection, so a hot statement is parsed once per connection and
+    afterwards only executed with new parameters.
+
+    Statements slower than slow_query_log.threshold are logged with their EXPLAIN plan when the cursor is closed."""
+
+    def __init__(self, conn, queryName=None):
+        self.connection = conn
+        self.queryName = queryName
+        self.current = None
+        self.slowStatements = []
+
+    def statementCache(self):
+        cnx = getattr(self.connection, "_cnx", self.connection)
+        cache = getattr(cnx, "preparedStatements", None)
+        # statements do not survive a reconnect of the pooled connection
+        if cache is None or cache["connection_id"] != cnx.connection_id:
+            cache = {"connection_id": cnx.connection_id, "statements": OrderedDict()}
+            cnx.preparedStatements = cache
+        return cache
+
+    def prepared(self, sql):
+        """Return (cursor, sql) where sql is the very string object the cursor was prepared with,
+        which is what makes the connector skip preparing it again."""
+        cache = self.statementCache()
+        statements = cache["statements"]
+        entry = statements.get(sql)
+        if entry is None:
+            entry = (self.connection.cursor(prepared=True), sql)
+            statements[sql] = entry
+            counter = "statements_prepared"
+            while len(statements) > statementCacheSize:
+                _, (oldCursor, _) = statements.popitem(last=False)
+                oldCursor.close()
+        else:
+            statements.move_to_end(sql)
+            counter = "statements_reused"
+        with poolLock:
+            poolStats[counter] += 1
+        return entry
+
+    def execute(self, sql, params=()):
+        cur, sql = self.prepared(sql)
+        self.current = cur
+        params = tuple(params)
+        started = time.perf_counter()
+        cur.execute(sql, params)
+        self.checkDuration(sql, params, started)
+
+    def executemany(self, sql, seqParams):
+        cur, sql = self.prepared(sql)
+        self.current = cur
+        seqParams = [tuple(params) for params in seqParams]
+        started = time.perf_counter()
+        cur.executemany(sql, seqParams)
+        self.checkDuration(sql, seqParams[0] if seqParams else (), started)
+
+    def checkDuration(self, sql, params, started):
+        threshold = slow_query_log.threshold
+        if threshold is None:
+            return
+        duration = time.perf_counter() - started
+        if duration >= threshold:
+            # the connection may still hold the rows of the statement, EXPLAIN has to wait until close()
+            self.slowStatements.append((sql, params, duration))
+
+    def explain(self, sql, params):
+        cur = self.connection.cursor(dictionary=True)
+        try:
+            cur.execute("EXPLAIN " + sql, params)
+            return cur.fetchall()
+        except mysql.connector.Error as e:
+            return "EXPLAIN failed: " + str(e)
+        finally:
+            cur.close()
+
+    def logSlowStatements(self):
+        slowStatements, self.slowStatements = self.slowStatements, []
+        for sql, params, duration in slowStatements:
+            slow_query_log.record(sql, params, duration, self.queryName, self.explain(sql, params))
+
+    def fetchone(self):
+        return self.current.fetchone()
+
+    def fetchmany(self, size=1):
+        return self.current.fetchmany(size)
+
+    def fetchall(self):
+        return self.current.fetchall()
+
+    @property
+    def rowcount(self):
+        return self.current.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.current.lastrowid
+
+    def close(self):
+        """Read away unfetched rows; the prepared cursors themselves stay open for the next query."""
+        if self.current is not None and self.connection.unread_result:
+            self.current.fetchall()
+        self.current = None
+        if self.slowStatements:
+            self.logSlowStatements()
+
+def getSQLCursor(conn, queryName=None):
+    cur = PreparedCursor(conn, queryName)
     return cur
 
+def fetchRows(cur, rowType):
+    return [rowType._make(row) for row in cur.fetchall()]
+
+def fetchRow(cur, rowType):
+    row = cur.fetchone()
+    return rowType._make(row) if row is not None else None
+
+def getPoolStats():
+    """Current pool usage: connections in use/idle and time spent waiting for a connection (seconds).
+    statements_prepared/statements_reused count statement preparations and executions of an already prepared statement."""
+    with poolLock:
+        stats = dict(poolStats)
+    stats["size"] = poolSize
+    stats["idle"] = poolSize - stats["in_use"]
+    stats["wait_time_avg"] = stats["wait_time_total"] / stats["borrowed"] if stats["borrowed"] else 0.0
+    return stats
+
 @queryWrapper
-def isValidUser(userId):
-    cur.execute("SELECT 1 FROM users WHERE user_id = '"+str(userId)+"'")
+def isValidUser(cur, userId):
+    cur.execute("SELECT 1 FROM users WHERE user_id = %s", (userId,))
     result = cur.fetchall()
     return result
 
+def isAuthorized(userId) -> bool:
+    """isValidUser behind the authorization cache; only users without a cached decision cost a query."""
+    allowed = contract_cache.authorization.lookup(userId)
+    if allowed is None:
+        allowed = len(isValidUser(userId)) > 0
+        contract_cache.authorization.remember(userId, allowed)
+    return allowed
+
+def invalidateAuthorization(userId=None):
+    """Call after changing the users table so the next check goes to the database again."""
+    contract_cache.authorization.invalidate(userId)
+
 @queryWrapper
-def getAllActiveContracts():
-    cur.execute("SELECT contract_id, contract_start, contract_end, contract_next_cancellation_date, notice_period_months, contract_renewal_period_months " +
+def getAllActiveContracts(cur):
+    cur.execute("SELECT contract_id, contract_end, contract_next_cancellation_date, contract_renewal_period_months " +
                  "FROM contracts WHERE is_active = 1")
-    result = cur.fetchall()
+    result = fetchRows(cur, RenewalCandidate)
     return result
 
 @queryWrapper
-def deleteContractById(Id):
+def deleteContractById(cur, userId, Id):
     try:
-        cur.execute("DELETE FROM contracts WHERE contract_id = '"+str(Id)+"'")
+        cur.execute("DELETE FROM contracts WHERE contract_id = %s AND user_id = %s", (Id, userId))
+        if cur.rowcount:
+            dueIndex.remove(Id)
+            contract_cache.invalidate("contractViews", Id)
     except mysql.connector.Error as e:
         print(f"Error while trying to delete: {e}")   
 
 @queryWrapper
-def getActiveContractCategories():
+def getActiveContractCategories(cur, userId):
+    """Categories in which the user has active contracts."""
     cur.execute("SELECT DISTINCT contract_categories.contract_category_id, contract_categories.contract_category " + 
                 "FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " + 
-                "JOIN contract_categories ON contract_types.contract_category = contract_categories.contract_category_id WHERE contracts.is_active = 1")
-    result = cur.fetchall()
+                "JOIN contract_categories ON contract_types.contract_category = contract_categories.contract_category_id " +
+                "WHERE contracts.user_id = %s AND contracts.is_active = 1", (userId,))
+    result = fetchRows(cur, Category)
     return result
 
+@contract_cache.cachedQuery()
 @queryWrapper
-def getContractCategories():
-    cur.execute("SELECT * FROM contract_categories")
-    result = cur.fetchall()
+def getContractCategories(cur):
+    cur.execute("SELECT contract_category_id, contract_category FROM contract_categories")
+    result = fetchRows(cur, Category)
+    return result
+
+@queryWrapper
+def getActiveContractCategoriesPage(cur, userId, afterId, limit):
+    """Keyset page of getActiveContractCategories: categories with an id greater than afterId."""
+    cur.execute("SELECT DISTINCT contract_categories.contract_category_id, contract_categories.contract_category " +
+                "FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " +
+                "JOIN contract_categories ON contract_types.contract_category = contract_categories.contract_category_id " +
+                "WHERE contracts.user_id = %s AND contracts.is_active = 1 AND contract_categories.contract_category_id > %s " +
+                "ORDER BY contract_categories.contract_category_id LIMIT %s", (userId, afterId or 0, limit))
+    result = fetchRows(cur, Category)
+    return result
+
+@contract_cache.cachedQuery()
+@queryWrapper
+def getContractCategoriesPage(cur, afterId, limit):
+    """Keyset page of getContractCategories: categories with an id greater than afterId."""
+    cur.execute("SELECT contract_category_id, contract_category FROM contract_categories WHERE contract_category_id > %s " +
+                "ORDER BY contract_category_id LIMIT %s", (afterId or 0, limit))
+    result = fetchRows(cur, Category)
     return result
 
+@contract_cache.cachedQuery()
 @queryWrapper
-def getContractTypes(category):
+def getContractTypes(cur, category):
     cur.execute("SELECT contract_types.contract_type_id, contract_types.contract_type FROM contract_types " + 
                 "JOIN contract_categories ON contract_types.contract_category = contract_categories.contract_category_id " + 
-                "WHERE contract_categories.contract_category_id = '"+category+"'")
-    result = cur.fetchall()
+                "WHERE contract_categories.contract_category_id = %s", (category,))
+    result = fetchRows(cur, ContractType)
     return result
 
 @queryWrapper
-def getAllContracts():
-    cur.execute("SELECT * FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " + 
-                "JOIN contractors ON contractors.contractor_id = contracts.contractor")
-    result = cur.fetchall()
+def getAllContracts(cur, userId):
+    cur.execute("SELECT contracts.contract_id, contracts.user_id, contract_types.contract_type, contractors.contractor_name, contracts.contract_fee, " +
+                "contracts.contract_end, contracts.contract_next_cancellation_date, contracts.contract_renewal_period_months, contracts.is_active, contracts.alert_active " +
+                "FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " +
+                "JOIN contractors ON contractors.contractor_id = contracts.contractor WHERE contracts.user_id = %s", (userId,))
+    result = fetchRows(cur, Contract)
     return result
 
 @queryWrapper
-def getContracts(type):
-    cur.execute("SELECT * FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " + 
-                "JOIN contractors ON contractors.contractor_id = contracts.contractor WHERE contract_types.contract_type_id = '"+type+"'")
-    result = cur.fetchall()
+def getContracts(cur, userId, type):
+    cur.execute("SELECT contracts.contract_id, contracts.user_id, contract_types.contract_type, contractors.contractor_name, contracts.contract_fee, " +
+                "contracts.contract_end, contracts.contract_next_cancellation_date, contracts.contract_renewal_period_months, contracts.is_active, contracts.alert_active " +
+                "FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " +
+                "JOIN contractors ON contractors.contractor_id = contracts.contractor WHERE contracts.user_id = %s AND contracts.contract_type = %s", (userId, type))
+    result = fetchRows(cur, Contract)
     return result
 
 @queryWrapper
-def getBeneficiaries():
-    cur.execute("SELECT * FROM contract_beneficiaries")
-    result = cur.fetchall()
+def getContractsPage(cur, userId, type, afterId, limit):
+    """Keyset page of the user's contracts of a type: (contract_id, contract_type, contractor_name) with an id greater than afterId."""
+    cur.execute("SELECT contracts.contract_id, contract_types.contract_type, contractors.contractor_name " +
+                "FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " +
+                "JOIN contractors ON contractors.contractor_id = contracts.contractor " +
+                "WHERE contracts.user_id = %s AND contracts.contract_type = %s AND contracts.contract_id > %s ORDER BY contracts.contract_id LIMIT %s", (userId, type, afterId or 0, limit))
+    result = fetchRows(cur, ContractListItem)
+    return result
+
+@queryWrapper
+def getDueContracts(cur, userIds, today, milestones):
+    """Active contracts of the given users with alerting switched on that crossed a reminder milestone
+    (days before the next cancellation date, e.g. 14/7/1) they have not been reminded of yet.
+    Each row carries the milestone reached. Backed by the index idx_contracts_due (see contract_schema)."""
+    if not userIds:
+        return []
+    daysLeft = "DATEDIFF(contracts.contract_next_cancellation_date, %s)"
+    milestone = "CASE " + " ".join(["WHEN " + daysLeft + " <= " + str(int(m)) + " THEN " + str(int(m)) for m in sorted(milestones)]) + " END"
+    params = [today] + [today] * len(milestones) + list(userIds) + [today, today + timedelta(days=max(milestones))] + [today] * len(milestones)
+    cur.execute("SELECT contracts.user_id, contracts.contract_id, contract_types.contract_type, contractors.contractor_name, contracts.contract_renewal_period_months, " +
+                "contracts.contract_next_cancellation_date, " + daysLeft + " AS days_left, " + milestone + " AS milestone " +
+                "FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " +
+                "JOIN contractors ON contractors.contractor_id = contracts.contractor " +
+                "WHERE contracts.user_id IN (" + ", ".join(["%s"] * len(userIds)) + ") AND contracts.is_active = 1 AND contracts.alert_active = 1 " +
+                "AND contracts.contract_next_cancellation_date BETWEEN %s AND %s " +
+                "AND (contracts.alert_last_milestone IS NULL OR contracts.alert_last_milestone > " + milestone + ") " +
+                "ORDER BY contracts.user_id, contracts.contract_next_cancellation_date", params)
+    result = fetchRows(cur, DueContract)
     return result
 
 @queryWrapper
-def getContractors():
+def markContractsNotified(cur, notified, today):
+    """Remember the milestone each contract was last reminded of. notified is a list of (contract_id, milestone)."""
+    for start in range(0, len(notified), 500):
+        batch = notified[start:start + 500]
+        params = []
+        for contractId, milestone in batch:
+            params += [contractId, milestone]
+        params.append(today)
+        params += [contractId for contractId, _ in batch]
+        cur.execute("UPDATE contracts SET alert_last_milestone = CASE contract_id " + " ".join(["WHEN %s THEN %s"] * len(batch)) + " END, " +
+                    "alert_last_notified = %s WHERE contract_id IN (" + ", ".join(["%s"] * len(batch)) + ")", params)
+    dueIndex.setMilestones(notified)
+
+@contract_cache.cachedQuery(maxSize=1024)
+@queryWrapper
+def getBeneficiaries(cur, userId):
+    """Beneficiaries of the user and the shared ones (user_id NULL).
+    contract_schema.backfillOwners assigns rows only one user refers to, the others stay shared."""
+    cur.execute("SELECT id, name FROM contract_beneficiaries WHERE user_id = %s OR user_id IS NULL ORDER BY id", (userId,))
+    result = fetchRows(cur, Beneficiary)
+    return result
+
+@contract_cache.cachedQuery()
+@queryWrapper
+def getContractors(cur):
     cur.execute("SELECT contractor_id, contractor_name FROM contractors ORDER BY contractor_name")
-    result = cur.fetchall()
+    result = fetchRows(cur, Contractor)
     return result
 
+@contract_cache.cachedQuery()
 @queryWrapper
-def getPeriods():
-    cur.execute("SELECT * FROM payment_periods")
-    result = cur.fetchall()
+def getContractorsPage(cur, afterKey, limit):
+    """Keyset page of getContractors, ordered by name. afterKey is the (contractor_name, contractor_id) of the last row of the previous page."""
+    if afterKey is None:
+        cur.execute("SELECT contractor_id, contractor_name FROM contractors ORDER BY contractor_name, contractor_id LIMIT %s", (limit,))
+    else:
+        cur.execute("SELECT contractor_id, contractor_name FROM contractors WHERE contractor_name > %s OR (contractor_name = %s AND contractor_id > %s) " +
+                    "ORDER BY contractor_name, contractor_id LIMIT %s", (afterKey[0], afterKey[0], afterKey[1], limit))
+    result = fetchRows(cur, Contractor)
+    return result
+
+@contract_cache.cachedQuery()
+@queryWrapper
+def getPeriods(cur):
+    cur.execute("SELECT period_id, period_name FROM payment_periods")
+    result = fetchRows(cur, Period)
     return result    
 
+@contract_cache.cachedQuery(maxSize=1024)
 @queryWrapper
-def getAccounts():
-    cur.execute("SELECT * FROM bankaccounts")
-    result = cur.fetchall()   
+def getAccounts(cur, userId):
+    """Bank accounts of the user and the shared ones (user_id NULL).
+    contract_schema.backfillOwners assigns rows only one user refers to, the others stay shared."""
+    cur.execute("SELECT account_id, account_IBAN FROM bankaccounts WHERE user_id = %s OR user_id IS NULL ORDER BY account_id", (userId,))
+    result = fetchRows(cur, Account)   
     return result  
 
 @queryWrapper
-def getContractById(id):
-    cur.execute("SELECT contract_id, contract_fee, name, period_name, contractor_name, contract_types.contract_type, bankaccounts.account_IBAN," + 
-                "contract_next_cancellation_date FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " + 
+def getContractById(cur, userId, id):
+    """Details of one of the user's contracts, None if it does not exist or belongs to someone else."""
+    cur.execute("SELECT contracts.contract_id, contracts.contract_fee, contract_beneficiaries.name, payment_periods.period_name, contractors.contractor_name, " +
+                "contract_types.contract_type, bankaccounts.account_IBAN, contracts.contract_next_cancellation_date FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " + 
                 "JOIN contract_beneficiaries ON contract_beneficiaries.id = contracts.contract_beneficiary_1 " + 
                 "JOIN payment_periods ON payment_periods.period_id = contracts.contract_payment_period " + 
                 "JOIN contractors ON contractors.contractor_id = contracts.contractor JOIN bankaccounts ON bankaccounts.account_id = contracts.bankaccount " + 
-                "WHERE contracts.contract_id = '"+str(id)+"'")
-    result = cur.fetchone()
+                "WHERE contracts.contract_id = %s AND contracts.user_id = %s", (id, userId))
+    result = fetchRow(cur, ContractDetails)
     return result
 
-@queryWrapper
+@metrics.timedQuery
 def saveContract(data):
+    """Insert a contract and return (contract_id,).
+    A category (data['newCategoryName']) and type (data['newTypeName']) created during the conversation
+    are inserted in the same transaction, using the generated keys directly."""
     for key, value in data.items():
         print(key, ":", value)
 
-    try: cur.execute("INSERT INTO contracts(user_id, contract_type, contract_beneficiary_1, contractor, contract_fee, contract_payment_period, bankaccount, notice_period_months," + 
+    try:
+        with unitOfWork("saveContract") as uow:
+            categoryId = data.get('category')
+            typeId = data.get('type')
+            if data.get('newCategoryName'):
+                categoryId = uow.insert("INSERT INTO contract_categories SET contract_category = %s", (data['newCategoryName'],))
+                uow.afterCommit(invalidateCategories)
+            if data.get('newTypeName'):
+                typeId = uow.insert("INSERT INTO contract_types(contract_type, contract_category) VALUES (%s, %s)", (data['newTypeName'], categoryId))
+                uow.afterCommit(lambda: contract_cache.invalidate("getContractTypes", categoryId))
+            contractId = uow.insert("INSERT INTO contracts(user_id, contract_type, contract_beneficiary_1, contractor, contract_fee, contract_payment_period, bankaccount, notice_period_months," + 
                 "contract_start, contract_end, contract_next_cancellation_date, contract_renewal_period_months) " + 
-                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);", (data['userid'],
-                                                                data['type'],
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", (data['userid'],
+                                                                typeId,
                                                                 data['beneficiary'],
                                                                 data['contractor'],
                                                                 data['fee'],
@@ -139,37 +543,276 @@ def saveContract(data):
                                                                 data['enddate'],
                                                                 data['nextcancellationdate'],
                                                                 data['renewalperiod']))
-    
+            uow.afterCommit(lambda: refreshDueIndex(contractId))
     except mysql.connector.Error as e:
-        print(f"Error while inserting contract: {e}") 
-    cur.execute("SELECT LAST_INSERT_ID()")
-    result = cur.fetchone()
+        print(f"Error while inserting contract: {e}")
+        raise
 
-    return result
+    return (contractId,)
+
+def invalidateCategories():
+    contract_cache.invalidate("getContractCategories")
+    contract_cache.invalidate("getContractCategoriesPage")
 
 @queryWrapper
-def newCategory(categoryName):
-   cur.execute("INSERT INTO contract_categories SET contract_category = '"+categoryName+"'")
-   cur.execute("SELECT MAX(contract_category_id) FROM contract_categories")
-   result = cur.fetchone()
+def newCategory(cur, categoryName):
+   cur.execute("INSERT INTO contract_categories SET contract_category = %s", (categoryName,))
+   result = (cur.lastrowid,)
+   invalidateCategories()
    return result
 
 @queryWrapper
-def newType(categoryID, typeName):
-   cur.execute("INSERT INTO contract_types(contract_type, contract_category) VALUES (?, ?)", (typeName, categoryID))
-   cur.execute("SELECT MAX(contract_type_id) FROM contract_types")
-   result = cur.fetchone()   
+def newType(cur, categoryID, typeName):
+   cur.execute("INSERT INTO contract_types(contract_type, contract_category) VALUES (%s, %s)", (typeName, categoryID))
+   result = (cur.lastrowid,)
+   contract_cache.invalidate("getContractTypes", categoryID)
    return result
 
 @queryWrapper
-def updateContractDates(data):
-    executestring = "UPDATE contracts SET contract_end = '"+data[1]+"', contract_next_cancellation_date = '"+data[2]+"' WHERE contract_id = " +str(data[0])+" "
-    cur.execute(executestring)
+def updateContractDates(cur, data):
+    cur.execute("UPDATE contracts SET contract_end = %s, contract_next_cancellation_date = %s, alert_last_milestone = NULL, alert_last_notified = NULL " +
+                "WHERE contract_id = %s", (data[1], data[2], data[0]))
+    dueIndex.updateDate(data[0], data[2])
+    contract_cache.invalidate("contractViews", data[0])
+
+@queryWrapper
+def getOverdueContracts(cur, today):
+    """Active contracts whose next cancellation date has passed, i.e. that renewed automatically."""
+    cur.execute("SELECT contract_id, contract_end, contract_next_cancellation_date, contract_renewal_period_months " +
+                "FROM contracts WHERE is_active = 1 AND contract_next_cancellation_date < %s AND contract_renewal_period_months > 0", (today,))
+    result = fetchRows(cur, RenewalCandidate)
+    return result
+
+@transactionWrapper
+def renewContracts(cur, batches):
+    """Write new end and cancellation dates in one transaction and reset the reminder milestones.
+    batches is an iterable of lists of (contract_id, contract_end, contract_next_cancellation_date); each list becomes one UPDATE.
+    contract_end may be None for contracts without end date."""
+    updated = 0
+    for batch in batches:
+        if not batch:
+            continue
+        cases = " ".join(["WHEN %s THEN %s"] * len(batch))
+        params = []
+        for contractId, enddate, _ in batch:
+            params += [contractId, enddate]
+        for contractId, _, nextcanceldate in batch:
+            params += [contractId, nextcanceldate]
+        params += [contractId for contractId, _, _ in batch]
+        cur.execute("UPDATE contracts SET contract_end = CASE contract_id " + cases + " END, " +
+                    "contract_next_cancellation_date = CASE contract_id " + cases + " END, " +
+                    "alert_last_milestone = NULL, alert_last_notified = NULL " +
+                    "WHERE contract_id IN (" + ", ".join(["%s"] * len(batch)) + ")", params)
+        updated += cur.rowcount
+        for contractId, _, _ in batch:
+            contract_cache.invalidate("contractViews", contractId)
+    return updated
 
 @queryWrapper
-def setContractAlertingStatus(contractId: int, alertingStatus: int):
+def setContractAlertingStatus(cur, userId, contractId: int, alertingStatus: int):
     """Set Alertings Status of contract to 1 or 0"""
     print("setting alertingstatus of contract: "+str(contractId)+" to: "+str(alertingStatus))
-    try: cur.execute("UPDATE contracts SET alert_active = '"+str(alertingStatus)+"' WHERE contract_id = '"+str(contractId)+"'")
+    try:
+        cur.execute("UPDATE contracts SET alert_active = %s WHERE contract_id = %s AND user_id = %s", (alertingStatus, contractId, userId))
+        if cur.rowcount:
+            dueIndex.setAlerting(contractId, alertingStatus)
     except mysql.connector.Error as e:
-        print("Something went wrong while updating the alerting status of the contract: {}".format(e))
\ No newline at end of file
+        print("Something went wrong while updating the alerting status of the contract: {}".format(e))
+
+indexedContractColumns = ("SELECT contracts.contract_id, contracts.user_id, contract_types.contract_type, contractors.contractor_name, " +
+                          "contracts.contract_renewal_period_months, contracts.contract_next_cancellation_date, contracts.alert_active, contracts.alert_last_milestone " +
+                          "FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " +
+                          "JOIN contractors ON contractors.contractor_id = contracts.contractor ")
+
+@queryWrapper
+def getIndexedContracts(cur):
+    """All active contracts with a cancellation date, as loaded into the due-date index."""
+    cur.execute(indexedContractColumns + "WHERE contracts.is_active = 1 AND contracts.contract_next_cancellation_date IS NOT NULL")
+    result = fetchRows(cur, IndexedContract)
+    return result
+
+@queryWrapper
+def getIndexedContract(cur, contractId):
+    cur.execute(indexedContractColumns + "WHERE contracts.contract_id = %s AND contracts.is_active = 1", (contractId,))
+    result = fetchRow(cur, IndexedContract)
+    return result
+
+def warmDueIndex(today=None):
+    """(Re)load the due-date index (see contract_dueindex) and return the number of contracts in it."""
+    rows = getIndexedContracts()
+    dueIndex.load(rows, today or date.today())
+    # renewals by other processes (contracts_datechecker) change cancellation dates shown in the views
+    contract_cache.invalidate("contractViews")
+    return len(rows)
+
+def refreshDueIndex(contractId):
+    """Reload one contract into the due-date index after it was written."""
+    if not dueIndex.ready:
+        return
+    row = getIndexedContract(contractId)
+    if row is None:
+        dueIndex.remove(contractId)
+    else:
+        dueIndex.upsert(row)
+
+def selectExportRows(cur, userId):
+    """Run the statement of streamContracts on cur, the rows are left for the caller to fetch."""
+    cur.execute("SELECT contracts.contract_id, contract_categories.contract_category, contract_types.contract_type, contractors.contractor_name, " +
+                "contract_beneficiaries.name, payment_periods.period_name, bankaccounts.account_IBAN, contracts.contract_fee, " +
+                "contracts.contract_start, contracts.contract_end, contracts.contract_next_cancellation_date, contracts.notice_period_months, " +
+                "contracts.contract_renewal_period_months, contracts.is_active, contracts.alert_active " +
+                "FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " +
+                "JOIN contract_categories ON contract_types.contract_category = contract_categories.contract_category_id " +
+                "JOIN contractors ON contractors.contractor_id = contracts.contractor " +
+                "LEFT JOIN contract_beneficiaries ON contract_beneficiaries.id = contracts.contract_beneficiary_1 " +
+                "LEFT JOIN payment_periods ON payment_periods.period_id = contracts.contract_payment_period " +
+                "LEFT JOIN bankaccounts ON bankaccounts.account_id = contracts.bankaccount " +
+                "WHERE contracts.user_id = %s ORDER BY contracts.contract_id", (userId,))
+
+def streamContracts(userId, batchSize=500):
+    """Generator over all contracts of the user as ExportRow, read from an unbuffered cursor in batches
+    of batchSize rows, so memory use does not grow with the number of contracts.
+    Holds a pooled connection until the generator is exhausted or closed.
+    The metrics and the slow-query log see the statement up to its first row; reading the
+    rows is paced by the consumer and not timed."""
+    conn = getConnection()
+    try:
+        cur = conn.cursor(buffered=False)
+        # only used to log the statement if it is slow, with EXPLAIN once all rows are read
+        slowLog = getSQLCursor(conn, "streamContracts")
+        try:
+            with metrics.observed(metrics.queryLatency, metrics.queryErrors, "streamContracts"):
+                started = time.perf_counter()
+                selectExportRows(cur, userId)
+                slowLog.checkDuration(cur.statement, (), started)
+            while True:
+                rows = cur.fetchmany(batchSize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield ExportRow._make(row)
+        finally:
+            # an abandoned export leaves rows on the connection, read them away before it goes back to the pool
+            if conn.unread_result:
+                conn.consume_results()
+            cur.close()
+            slowLog.close()
+    finally:
+        releaseConnection(conn)
+
+def nameKey(name) -> str:
+    """Key under which names are compared: case-insensitive and without surrounding spaces, close to MySQL's _ci collations."""
+    return str(name).strip().casefold()
+
+def resolveNames(uow, table, idColumn, nameColumn, names) -> dict:
+    """Ids of the rows of table with the given names (see nameKey), inserting missing names in one statement.
+    The first spelling of a name is the one inserted. Returns {nameKey(name): id}; names the database
+    matches differently than nameKey (e.g. accent-insensitive collations) may be missing."""
+    unique = {}
+    for name in names:
+        unique.setdefault(nameKey(name), name)
+    names = list(unique.values())
+    if not names:
+        return {}
+    select = "SELECT " + idColumn + ", " + nameColumn + " FROM " + table + " WHERE " + nameColumn + " IN (" + ", ".join(["%s"] * len(names)) + ")"
+    ids = {nameKey(name): id for id, name in uow.execute(select, names).fetchall()}
+    missing = [name for name in names if nameKey(name) not in ids]
+    if missing:
+        uow.insertMany("INSERT INTO " + table + " (" + nameColumn + ") VALUES (%s)", [(name,) for name in missing])
+        ids = {nameKey(name): id for id, name in uow.execute(select, names).fetchall()}
+    return ids
+
+def resolveTypes(uow, types) -> dict:
+    """Ids of the contract types given as (category id, type name), inserting missing ones in one statement.
+    Returns {(category id, nameKey(type name)): id}."""
+    unique = {}
+    for categoryId, name in types:
+        unique.setdefault((categoryId, nameKey(name)), (categoryId, name))
+    types = list(unique.values())
+    if not types:
+        return {}
+    categoryIds = sorted({categoryId for categoryId, _ in types})
+    select = ("SELECT contract_type_id, contract_category, contract_type FROM contract_types WHERE contract_category IN (" +
+              ", ".join(["%s"] * len(categoryIds)) + ")")
+    ids = {(categoryId, nameKey(name)): id for id, categoryId, name in uow.execute(select, categoryIds).fetchall()}
+    missing = [(name, categoryId) for categoryId, name in types if (categoryId, nameKey(name)) not in ids]
+    if missing:
+        uow.insertMany("INSERT INTO contract_types (contract_type, contract_category) VALUES (%s, %s)", missing)
+        ids = {(categoryId, nameKey(name)): id for id, categoryId, name in uow.execute(select, categoryIds).fetchall()}
+    return ids
+
+@metrics.timedQuery
+def importContracts(userId, contracts, chunkSize=200):
+    """Insert many contracts of the user and return (number imported, [(line, error)]).
+
+    contracts are dicts with the keys of saveContract, except that category, type and contractor are names.
+    Categories, types and contractors are looked up (or created) in one transaction first, then the
+    contracts are inserted chunkSize at a time, each chunk a transaction of its own. If the lookup fails,
+    all lines are reported with the database error; if a chunk fails, all lines of the chunk.
+    Lines whose names could not be resolved are reported as well."""
+    try:
+        with unitOfWork("importContracts") as uow:
+            categories = resolveNames(uow, "contract_categories", "contract_category_id", "contract_category", [c['category'] for c in contracts])
+            types = resolveTypes(uow, [(categories[nameKey(c['category'])], c['type']) for c in contracts if nameKey(c['category']) in categories])
+            contractors = resolveNames(uow, "contractors", "contractor_id", "contractor_name", [c['contractor'] for c in contracts])
+            uow.afterCommit(invalidateCategories)
+            uow.afterCommit(lambda: contract_cache.invalidate("getContractTypes"))
+            uow.afterCommit(lambda: contract_cache.invalidate("getContractors"))
+            uow.afterCommit(lambda: contract_cache.invalidate("getContractorsPage"))
+    except mysql.connector.Error as e:
+        print(f"Error while importing contracts: {e}")
+        return 0, [(c['line'], "Datenbankfehler: " + str(e)) for c in contracts]
+
+    imported = 0
+    errors = []
+    rows = []
+    for c in contracts:
+        categoryId = categories.get(nameKey(c['category']))
+        typeId = types.get((categoryId, nameKey(c['type'])))
+        contractorId = contractors.get(nameKey(c['contractor']))
+        if categoryId is None or typeId is None or contractorId is None:
+            unresolved = []
+            if categoryId is None:
+                unresolved.append("category")
+            # a type can only be resolved within its category, so it is not reported on its own
+            if categoryId is not None and typeId is None:
+                unresolved.append("type")
+            if contractorId is None:
+                unresolved.append("contractor")
+            unresolved = [column + " \"" + c[column] + "\"" for column in unresolved]
+            errors.append((c['line'], ", ".join(unresolved) + " konnte nicht zugeordnet werden"))
+            continue
+        rows.append((c['line'], (userId, typeId, c['beneficiary'], contractorId, c['fee'], c['period'], c['account'], c['noticeperiod'],
+                                 c['startdate'], c['enddate'], c['nextcancellationdate'], c['renewalperiod'])))
+
+    for start in range(0, len(rows), chunkSize):
+        chunk = rows[start:start + chunkSize]
+        try:
+            with unitOfWork("importContracts") as uow:
+                uow.insertMany("INSERT INTO contracts(user_id, contract_type, contract_beneficiary_1, contractor, contract_fee, contract_payment_period, bankaccount, notice_period_months," +
+                               "contract_start, contract_end, contract_next_cancellation_date, contract_renewal_period_months) " +
+                               "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", [params for _, params in chunk])
+            imported += len(chunk)
+        except mysql.connector.Error as e:
+            print(f"Error while importing contracts: {e}")
+            errors += [(line, "Datenbankfehler: " + str(e)) for line, _ in chunk]
+
+    if imported and dueIndex.ready:
+        warmDueIndex()
+    return imported, sorted(errors)
+
+@queryWrapper
+def getForecastContracts(cur, userId):
+    """Active contracts of the user with fee, payment period and term, see contract_forecast."""
+    cur.execute("SELECT contracts.contract_id, contract_categories.contract_category, contract_types.contract_type, contractors.contractor_name, " +
+                "contract_beneficiaries.name, contracts.contract_fee, " +
+                "payment_periods.period_name, payment_periods.period_months, contracts.contract_start, contracts.contract_end, " +
+                "contracts.contract_next_cancellation_date, contracts.notice_period_months, contracts.contract_renewal_period_months " +
+                "FROM contracts JOIN contract_types ON contracts.contract_type = contract_types.contract_type_id " +
+                "JOIN contract_categories ON contract_types.contract_category = contract_categories.contract_category_id " +
+                "JOIN contractors ON contractors.contractor_id = contracts.contractor " +
+                "LEFT JOIN contract_beneficiaries ON contract_beneficiaries.id = contracts.contract_beneficiary_1 " +
+                "LEFT JOIN payment_periods ON payment_periods.period_id = contracts.contract_payment_period " +
+                "WHERE contracts.user_id = %s AND contracts.is_active = 1", (userId,))
+    result = fetchRows(cur, ForecastContract)
+    return result
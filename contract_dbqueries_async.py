@@ -0,0 +1,124 @@
+"""Async variants of the contract_dbqueries functions.
+
+The queries run on a bounded thread pool, so the event loop of the bot keeps serving
+other chats while a query waits for the database. The executor never has more workers
+than the connection pool has connections.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import contract_dbqueries
+import contract_cache
+
+executor = ThreadPoolExecutor(max_workers=contract_dbqueries.poolSize, thread_name_prefix="dbquery")
+
+async def runQuery(func, *args, **kwargs):
+    """Run a synchronous query function on the executor and await its result.
+    The query sees the context variables of the caller (e.g. slow_query_log.currentHandler)."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, partial(context.run, func, *args, **kwargs))
+
+def shutdown(wait: bool = True) -> None:
+    executor.shutdown(wait=wait)
+
+async def isValidUser(userId):
+    return await runQuery(contract_dbqueries.isValidUser, userId)
+
+async def isAuthorized(userId):
+    allowed = contract_cache.authorization.lookup(userId)
+    if allowed is not None:
+        return allowed
+    return await runQuery(contract_dbqueries.isAuthorized, userId)
+
+def isKnownUnauthorized(userId) -> bool:
+    """Cheap check without any database access: True only for users already rejected."""
+    return contract_cache.authorization.lookup(userId) is False
+
+def invalidateAuthorization(userId=None):
+    contract_dbqueries.invalidateAuthorization(userId)
+
+async def getAllActiveContracts():
+    return await runQuery(contract_dbqueries.getAllActiveContracts)
+
+async def deleteContractById(userId, Id):
+    return await runQuery(contract_dbqueries.deleteContractById, userId, Id)
+
+async def getActiveContractCategories(userId):
+    return await runQuery(contract_dbqueries.getActiveContractCategories, userId)
+
+async def getContractCategories():
+    return await runQuery(contract_dbqueries.getContractCategories)
+
+async def getActiveContractCategoriesPage(userId, afterId, limit):
+    return await runQuery(contract_dbqueries.getActiveContractCategoriesPage, userId, afterId, limit)
+
+async def getContractCategoriesPage(afterId, limit):
+    return await runQuery(contract_dbqueries.getContractCategoriesPage, afterId, limit)
+
+async def getContractTypes(category):
+    return await runQuery(contract_dbqueries.getContractTypes, category)
+
+async def getAllContracts(userId):
+    return await runQuery(contract_dbqueries.getAllContracts, userId)
+
+async def getContracts(userId, type):
+    return await runQuery(contract_dbqueries.getContracts, userId, type)
+
+async def getContractsPage(userId, type, afterId, limit):
+    return await runQuery(contract_dbqueries.getContractsPage, userId, type, afterId, limit)
+
+async def getDueContracts(userIds, today, milestones):
+    return await runQuery(contract_dbqueries.getDueContracts, userIds, today, milestones)
+
+async def markContractsNotified(notified, today):
+    return await runQuery(contract_dbqueries.markContractsNotified, notified, today)
+
+async def getBeneficiaries(userId):
+    return await runQuery(contract_dbqueries.getBeneficiaries, userId)
+
+async def getContractors():
+    return await runQuery(contract_dbqueries.getContractors)
+
+async def getContractorsPage(afterKey, limit):
+    return await runQuery(contract_dbqueries.getContractorsPage, afterKey, limit)
+
+async def getPeriods():
+    return await runQuery(contract_dbqueries.getPeriods)
+
+async def getAccounts(userId):
+    return await runQuery(contract_dbqueries.getAccounts, userId)
+
+async def getContractById(userId, id):
+    return await runQuery(contract_dbqueries.getContractById, userId, id)
+
+async def saveContract(data):
+    return await runQuery(contract_dbqueries.saveContract, data)
+
+async def newCategory(categoryName):
+    return await runQuery(contract_dbqueries.newCategory, categoryName)
+
+async def newType(categoryID, typeName):
+    return await runQuery(contract_dbqueries.newType, categoryID, typeName)
+
+async def updateContractDates(data):
+    return await runQuery(contract_dbqueries.updateContractDates, data)
+
+async def getOverdueContracts(today):
+    return await runQuery(contract_dbqueries.getOverdueContracts, today)
+
+async def renewContracts(batches):
+    return await runQuery(contract_dbqueries.renewContracts, batches)
+
+async def setContractAlertingStatus(userId, contractId: int, alertingStatus: int):
+    return await runQuery(contract_dbqueries.setContractAlertingStatus, userId, contractId, alertingStatus)
+
+async def getForecastContracts(userId):
+    return await runQuery(contract_dbqueries.getForecastContracts, userId)
+
+async def warmDueIndex(today=None):
+    return await runQuery(contract_dbqueries.warmDueIndex, today)
+
+def getPoolStats():
+    return contract_dbqueries.getPoolStats()
@@ -0,0 +1,116 @@
+"""Process-local index of the active contracts, ordered by their next cancellation date.
+
+The index is loaded once with contract_dbqueries.warmDueIndex() and then kept up to date by the
+write functions of contract_dbqueries. Questions like "which contracts can be cancelled within the
+next 14 days?" are answered with a binary search on the sorted dates instead of a query.
+Until it is loaded, the index is empty and all updates are ignored.
+"""
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, timedelta
+from contract_rows import IndexedContract, DueContract
+
+class DueIndex:
+    """IndexedContract rows by contract id, plus a sorted list of (cancellation date, contract id)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contracts = {}
+        self.dates = []
+        self.loadedOn = None
+
+    @property
+    def ready(self) -> bool:
+        return self.loadedOn is not None
+
+    def load(self, rows, today: date) -> None:
+        """Replace the whole index, e.g. at startup or once a day."""
+        contracts = {row.contract_id: row for row in rows if row.contract_next_cancellation_date is not None}
+        dates = sorted((row.contract_next_cancellation_date, row.contract_id) for row in contracts.values())
+        with self.lock:
+            self.contracts = contracts
+            self.dates = dates
+            self.loadedOn = today
+
+    def _remove(self, contractId):
+        row = self.contracts.pop(contractId, None)
+        if row is not None:
+            position = bisect_left(self.dates, (row.contract_next_cancellation_date, contractId))
+            if position < len(self.dates) and self.dates[position][1] == contractId:
+                del self.dates[position]
+        return row
+
+    def _add(self, row: IndexedContract) -> None:
+        if row.contract_next_cancellation_date is None:
+            return
+        self.contracts[row.contract_id] = row
+        insort(self.dates, (row.contract_next_cancellation_date, row.contract_id))
+
+    def upsert(self, row: IndexedContract) -> None:
+        with self.lock:
+            if not self.ready:
+                return
+            self._remove(row.contract_id)
+            self._add(row)
+
+    def remove(self, contractId) -> None:
+        with self.lock:
+            if self.ready:
+                self._remove(contractId)
+
+    def updateDate(self, contractId, nextCancellationDate) -> None:
+        """New cancellation date; the reminder milestones start over."""
+        with self.lock:
+            row = self._remove(contractId) if self.ready else None
+            if row is not None:
+                self._add(row._replace(contract_next_cancellation_date=nextCancellationDate, alert_last_milestone=None))
+
+    def setAlerting(self, contractId, alertActive: int) -> None:
+        with self.lock:
+            row = self.contracts.get(contractId)
+            if row is not None:
+                self.contracts[contractId] = row._replace(alert_active=alertActive)
+
+    def setMilestones(self, notified) -> None:
+        """notified is a list of (contract_id, milestone), see contract_dbqueries.markContractsNotified."""
+        with self.lock:
+            for contractId, milestone in notified:
+                row = self.contracts.get(contractId)
+                if row is not None:
+                    self.contracts[contractId] = row._replace(alert_last_milestone=milestone)
+
+    def between(self, first: date, last: date, userIds=None) -> list:
+        """Contracts with a cancellation date from first to last (inclusive), ordered by date."""
+        with self.lock:
+            start = bisect_left(self.dates, (first,))
+            end = bisect_right(self.dates, (last, float("inf")))
+            rows = [self.contracts[contractId] for _, contractId in self.dates[start:end]]
+        if userIds is not None:
+            userIds = set(userIds)
+            rows = [row for row in rows if row.user_id in userIds]
+        return rows
+
+    def dueWithin(self, today: date, days: int, userIds=None) -> list:
+        return self.between(today, today + timedelta(days=days), userIds)
+
+    def dueContracts(self, userIds, today: date, milestones) -> list:
+        """Same result as contract_dbqueries.getDueContracts, answered from the index."""
+        result = []
+        for row in self.dueWithin(today, max(milestones), userIds):
+            if not row.alert_active:
+                continue
+            daysLeft = (row.contract_next_cancellation_date - today).days
+            milestone = min(m for m in milestones if daysLeft <= m)
+            if row.alert_last_milestone is not None and row.alert_last_milestone <= milestone:
+                continue
+            result.append(DueContract(row.user_id, row.contract_id, row.contract_type, row.contractor_name,
+                                      row.contract_renewal_period_months, row.contract_next_cancellation_date, daysLeft, milestone))
+        result.sort(key=lambda c: (c.user_id, c.contract_next_cancellation_date))
+        return result
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"contracts": len(self.contracts), "loaded_on": self.loadedOn}
+
+
+dueIndex = DueIndex()
@@ -0,0 +1,70 @@
+"""Export of all contracts of a user as CSV or JSON Lines.
+
+Rows flow from contract_dbqueries.streamContracts (unbuffered cursor) through exportLines into a
+file, one row at a time. Used by the /export command of the bot and on the command line:
+    python contract_export.py 123456789 --format jsonl --output contracts.jsonl
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import contract_dbqueries
+from contract_rows import ExportRow
+
+formats = ("csv", "jsonl")
+
+def csvLines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ExportRow._fields)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        yield buffer.getvalue()
+
+def jsonLines(rows):
+    for row in rows:
+        yield json.dumps(row._asdict(), default=str, ensure_ascii=False) + "\n"
+
+def exportLines(rows, format: str = "csv"):
+    """Generator of the text lines of an export of rows (ExportRow) in the given format."""
+    if format == "csv":
+        return csvLines(rows)
+    if format == "jsonl":
+        return jsonLines(rows)
+    raise ValueError("unknown export format " + str(format))
+
+def exportContracts(userId, file, format: str = "csv") -> int:
+    """Write all contracts of the user to the text file object and return the number of contracts."""
+    count = 0
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+    for line in exportLines(counted(contract_dbqueries.streamContracts(userId)), format):
+        file.write(line)
+    return count
+
+def exportToFile(userId, path: str, format: str = "csv") -> int:
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        return exportContracts(userId, file, format)
+
+def main():
+    parser = argparse.ArgumentParser(description="Verträge eines Nutzers exportieren")
+    parser.add_argument("userid", type=int, help="Telegram user id")
+    parser.add_argument("--format", choices=formats, default="csv")
+    parser.add_argument("--output", default="-", help="file to write, - for stdout")
+    args = parser.parse_args()
+    if args.output == "-":
+        count = exportContracts(args.userid, sys.stdout, args.format)
+    else:
+        count = exportToFile(args.userid, args.output, args.format)
+    print(str(count) + " contracts exported", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Projection of payments and cancellation/renewal dates of a user's active contracts.
+
+All contracts are projected at once with NumPy: the payment schedule is a (contracts x months)
+matrix built from datetime64 month arithmetic, and the term dates of every contract are shifted
+by whole renewal periods in one array operation, instead of stepping through every contract
+and period with relativedelta like contracts_datechecker does.
+"""
+from datetime import date
+from typing import NamedTuple
+import numpy as np
+
+# Number of months projected, starting with the current month
+horizonMonths = 24
+
+# Months between two payments by period name, for payment_periods rows without period_months (0 = one-off)
+periodMonthsByName = {
+    "monatlich": 1,
+    "zweimonatlich": 2,
+    "vierteljährlich": 3,
+    "quartalsweise": 3,
+    "halbjährlich": 6,
+    "jährlich": 12,
+    "zweijährlich": 24,
+    "einmalig": 0,
+}
+
+class Forecast(NamedTuple):
+    months: np.ndarray       # datetime64[M], horizonMonths entries
+    payments: np.ndarray     # (contracts, months): amount paid per contract and month
+    totals: np.ndarray       # (months,): sum of all payments per month
+    byCategory: dict         # category -> (months,) payments
+    byBeneficiary: dict      # beneficiary -> (months,) payments
+    events: list             # (date, "Kündigungsfrist" | "Verlängerung" | "Vertragsende", ForecastContract), by date
+
+def periodMonths(contract) -> int:
+    if contract.period_months is not None:
+        return int(contract.period_months)
+    return periodMonthsByName.get(str(contract.period_name or "").strip().lower(), 1)
+
+def toDays(values) -> np.ndarray:
+    """Dates (or None) as datetime64[D] (NaT)."""
+    return np.array([np.datetime64(v, "D") if v is not None else np.datetime64("NaT", "D") for v in values], dtype="datetime64[D]")
+
+def addMonths(days: np.ndarray, months: np.ndarray) -> np.ndarray:
+    """days plus months (broadcast), clipped to the last day of the month like relativedelta; NaT stays NaT."""
+    month = days.astype("datetime64[M]")
+    offset = days - month.astype("datetime64[D]")
+    target = month + np.asarray(months).astype("timedelta64[M]")
+    lastDay = (target + np.timedelta64(1, "M")).astype("datetime64[D]") - np.timedelta64(1, "D")
+    return np.minimum(target.astype("datetime64[D]") + offset, lastDay)
+
+def totalsBy(keys, payments: np.ndarray) -> dict:
+    """Sum the payment rows of all contracts with the same key."""
+    names, inverse = np.unique(np.array([k if k else "ohne Angabe" for k in keys], dtype=object), return_inverse=True)
+    totals = np.zeros((len(names), payments.shape[1]))
+    np.add.at(totals, inverse, payments)
+    return {name: totals[i] for i, name in enumerate(names)}
+
+def projectPayments(contracts, months: np.ndarray) -> np.ndarray:
+    fee = np.array([float(c.contract_fee or 0) for c in contracts])
+    period = np.array([periodMonths(c) for c in contracts])
+    # payments start with the contract; without a start date the schedule is anchored at the current month
+    anchor = toDays([c.contract_start for c in contracts]).astype("datetime64[M]")
+    anchor = np.where(np.isnat(anchor), months[0], anchor)
+    # contracts that renew automatically keep being paid, the others until their end
+    end = toDays([c.contract_end for c in contracts]).astype("datetime64[M]")
+    renews = np.array([int(c.contract_renewal_period_months or 0) > 0 for c in contracts])
+    lastMonth = np.where(renews | np.isnat(end), months[-1], end)
+
+    elapsed = (months[None, :] - anchor[:, None]).astype(int)
+    due = (elapsed >= 0) & (months[None, :] <= lastMonth[:, None])
+    due &= np.where(period[:, None] > 0, elapsed % np.maximum(period, 1)[:, None] == 0, elapsed == 0)
+    return np.where(due, fee[:, None], 0.0)
+
+def projectEvents(contracts, today: date, horizonEnd: np.datetime64) -> list:
+    renewal = np.array([int(c.contract_renewal_period_months or 0) for c in contracts])
+    notice = np.array([int(c.notice_period_months or 0) for c in contracts])
+    end = toDays([c.contract_end for c in contracts])
+    cancel = toDays([c.contract_next_cancellation_date for c in contracts])
+    cancel = np.where(np.isnat(cancel), addMonths(end, -notice), cancel)
+    start = np.datetime64(today, "D")
+
+    # first term whose cancellation date may lie in the window, then as many terms as fit into it
+    monthsBehind = (start.astype("datetime64[M]") - cancel.astype("datetime64[M]")).astype(float)
+    monthsBehind = np.where(np.isnat(cancel), 0, monthsBehind)
+    first = np.where(renewal > 0, np.maximum(0, np.floor(monthsBehind / np.maximum(renewal, 1)) - 1), 0).astype(int)
+    terms = first[:, None] + np.arange(horizonMonths // max(1, renewal[renewal > 0].min(initial=horizonMonths)) + 3)[None, :]
+    valid = (renewal[:, None] > 0) | (terms == 0)
+    shift = terms * renewal[:, None]
+
+    cancelDates = addMonths(cancel[:, None], shift)
+    endDates = addMonths(end[:, None], shift)
+    inWindow = lambda d: valid & (d >= start) & (d < horizonEnd)
+
+    events = []
+    for dates, kinds in ((cancelDates, None), (endDates, np.where(renewal > 0, "Verlängerung", "Vertragsende"))):
+        rows, cols = np.nonzero(inWindow(dates))
+        for i, j in zip(rows, cols):
+            events.append((dates[i, j].item(), "Kündigungsfrist" if kinds is None else str(kinds[i]), contracts[i]))
+    events.sort(key=lambda e: (e[0], e[2].contract_id))
+    return events
+
+def forecast(contracts, today: date) -> Forecast:
+    """Project the payments and term dates of the contracts (ForecastContract rows) for horizonMonths months from today."""
+    months = np.datetime64(today, "M") + np.arange(horizonMonths).astype("timedelta64[M]")
+    if not contracts:
+        empty = np.zeros((0, horizonMonths))
+        return Forecast(months, empty, np.zeros(horizonMonths), {}, {}, [])
+    payments = projectPayments(contracts, months)
+    horizonEnd = (months[-1] + np.timedelta64(1, "M")).astype("datetime64[D]")
+    return Forecast(months, payments, payments.sum(axis=0),
+                    totalsBy([c.contract_category for c in contracts], payments),
+                    totalsBy([c.beneficiary for c in contracts], payments),
+                    projectEvents(contracts, today, horizonEnd))
+
+def formatMoney(amount: float) -> str:
+    return "{:,.2f}".format(amount).replace(",", "X").replace(".", ",").replace("X", ".") + " €"
+
+def formatForecast(result: Forecast, maxEvents: int = 10) -> str:
+    text = "Kosten der nächsten " + str(horizonMonths) + " Monate: " + formatMoney(result.totals.sum()) + "\n\nPro Monat:"
+    for month, total in zip(result.months, result.totals):
+        text += "\n" + month.item().strftime("%m/%Y") + ": " + formatMoney(total)
+    for title, groups in (("Nach Kategorie:", result.byCategory), ("Nach Vertragsnehmer:", result.byBeneficiary)):
+        text += "\n\n" + title
+        for name, totals in sorted(groups.items(), key=lambda g: -g[1].sum()):
+            text += "\n" + str(name) + ": " + formatMoney(totals.sum())
+    if result.events:
+        text += "\n\nNächste Termine:"
+        for day, kind, contract in result.events[:maxEvents]:
+            text += "\n" + day.strftime("%d.%m.%Y") + " " + kind + ": " + str(contract.contract_type) + " bei " + str(contract.contractor_name)
+    return text
@@ -0,0 +1,116 @@
+"""Import of many contracts of a user from a CSV file.
+
+The file needs a header line with the columns in `columns` (separated by , or ;), e.g.
+    category;type;contractor;beneficiary;period;account;fee;noticeperiod;renewalperiod;startdate;enddate
+    Versicherung;Haftpflicht;HUK;Ich;jährlich;DE02120300000000202051;59,90;3;12;01.01.2024;31.12.2024
+Values are checked with the same rules as in the conversation (user_input). Beneficiary, period and
+account have to exist already and are given by name (or IBAN); categories, types and contractors are
+created if they are new. Used by the bot for uploaded .csv documents and on the command line:
+    python contract_import.py 123456789 contracts.csv
+"""
+import argparse
+import csv
+import io
+from typing import NamedTuple
+from dateutil.relativedelta import relativedelta
+import contract_dbqueries
+from user_input import UserInputType, isValid, parseDate, parseMonetary
+
+# column sizes of the names that are created if new (contract_schema.tables)
+maxLengths = {"category": 100, "type": 100, "contractor": 200}
+
+columns = ("category", "type", "contractor", "beneficiary", "period", "account", "fee", "noticeperiod", "renewalperiod", "startdate", "enddate")
+
+class ImportReport(NamedTuple):
+    imported: int
+    # (line number in the file, message), in line order
+    errors: list
+
+def readRows(text: str):
+    """csv.DictReader over text, accepting , and ; as separator."""
+    try:
+        dialect = csv.Sniffer().sniff(text.split("\n", 1)[0], delimiters=",;")
+    except csv.Error:
+        dialect = csv.excel
+    return csv.DictReader(io.StringIO(text), dialect=dialect)
+
+def byName(rows, key, name) -> dict:
+    return {str(getattr(row, name)).casefold(): getattr(row, key) for row in rows}
+
+def parseContracts(userId, text: str):
+    """Validate all rows and return (contracts for contract_dbqueries.importContracts, [(line, error)])."""
+    reader = readRows(text)
+    fields = [f.strip().lower() for f in (reader.fieldnames or [])]
+    missingColumns = [c for c in columns if c not in fields]
+    if missingColumns:
+        return [], [(1, "Spalte(n) fehlen: " + ", ".join(missingColumns))]
+    reader.fieldnames = fields
+
+    beneficiaries = byName(contract_dbqueries.getBeneficiaries(userId), "id", "name")
+    periods = byName(contract_dbqueries.getPeriods(), "period_id", "period_name")
+    accounts = byName(contract_dbqueries.getAccounts(userId), "account_id", "account_IBAN")
+
+    contracts = []
+    errors = []
+    for row in reader:
+        line = reader.line_num
+        values = {c: (row.get(c) or "").strip() for c in columns}
+        if not any(values.values()):
+            continue
+        problems = [c + " fehlt" for c in ("category", "type", "contractor") if not values[c]]
+        problems += [c + " ist länger als " + str(n) + " Zeichen" for c, n in maxLengths.items() if len(values[c]) > n]
+        contract = {"line": line, "category": values["category"], "type": values["type"], "contractor": values["contractor"]}
+        for column, known in (("beneficiary", beneficiaries), ("period", periods), ("account", accounts)):
+            contract[column] = known.get(values[column].casefold())
+            if contract[column] is None:
+                problems.append(column + " \"" + values[column] + "\" unbekannt")
+        try:
+            contract["fee"] = parseMonetary(values["fee"])
+        except ValueError:
+            problems.append("fee \"" + values["fee"] + "\" ist kein Betrag wie 12,99")
+        for column in ("noticeperiod", "renewalperiod"):
+            if isValid(values[column], UserInputType.AMOUNT):
+                contract[column] = int(values[column])
+            else:
+                problems.append(column + " \"" + values[column] + "\" ist keine Anzahl Monate")
+        for column in ("startdate", "enddate"):
+            try:
+                contract[column] = parseDate(values[column])
+            except ValueError:
+                problems.append(column + " \"" + values[column] + "\" ist kein Datum wie 31.12.2024")
+        if problems:
+            errors.append((line, "; ".join(problems)))
+            continue
+        contract["nextcancellationdate"] = contract["enddate"] - relativedelta(months=+contract["noticeperiod"])
+        contracts.append(contract)
+    return contracts, errors
+
+def importContracts(userId, text: str) -> ImportReport:
+    """Validate and import the CSV text, report imported contracts and the errors of all rejected lines."""
+    contracts, errors = parseContracts(userId, text)
+    imported = 0
+    if contracts:
+        imported, dbErrors = contract_dbqueries.importContracts(userId, contracts)
+        errors = sorted(errors + dbErrors)
+    return ImportReport(imported, errors)
+
+def formatReport(report: ImportReport) -> str:
+    text = str(report.imported) + " Vertrag/Verträge importiert."
+    if report.errors:
+        text += "\n" + str(len(report.errors)) + " Zeile(n) mit Fehlern:"
+        for line, message in report.errors:
+            text += "\nZeile " + str(line) + ": " + message
+    return text
+
+def main():
+    parser = argparse.ArgumentParser(description="Verträge eines Nutzers aus einer CSV-Datei importieren")
+    parser.add_argument("userid", type=int, help="Telegram user id")
+    parser.add_argument("file", help="CSV file, see contract_import for the columns")
+    args = parser.parse_args()
+    with open(args.file, encoding="utf-8-sig") as f:
+        report = importContracts(args.userid, f.read())
+    print(formatReport(report))
+
+
+if __name__ == "__main__":
+    main()
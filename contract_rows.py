@@ -0,0 +1,132 @@
+"""Row types returned by contract_dbqueries.
+
+Every query selects exactly the columns of its row type, in this order, so rows stay small and
+handlers access fields by name instead of by position in a SELECT * result.
+"""
+from datetime import date
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+class Category(NamedTuple):
+    contract_category_id: int
+    contract_category: str
+
+class ContractType(NamedTuple):
+    contract_type_id: int
+    contract_type: str
+
+class Beneficiary(NamedTuple):
+    id: int
+    name: str
+
+class Contractor(NamedTuple):
+    contractor_id: int
+    contractor_name: str
+
+class Period(NamedTuple):
+    period_id: int
+    period_name: str
+
+class Account(NamedTuple):
+    account_id: int
+    account_IBAN: str
+
+class ContractListItem(NamedTuple):
+    """One button in the list of contracts of a type."""
+    contract_id: int
+    contract_type: str
+    contractor_name: str
+
+class Contract(NamedTuple):
+    contract_id: int
+    user_id: int
+    contract_type: str
+    contractor_name: str
+    contract_fee: Decimal
+    contract_end: date
+    contract_next_cancellation_date: date
+    contract_renewal_period_months: int
+    is_active: int
+    alert_active: int
+
+class ContractDetails(NamedTuple):
+    """Everything the contract detail screen shows."""
+    contract_id: int
+    contract_fee: Decimal
+    name: str
+    period_name: str
+    contractor_name: str
+    contract_type: str
+    account_IBAN: str
+    contract_next_cancellation_date: date
+
+class ContractView(NamedTuple):
+    """The contract detail screen, rendered once from ContractDetails and cached.
+    The days left until the cancellation date go between head and tail."""
+    user_id: int
+    contract_id: int
+    contract_next_cancellation_date: date
+    head: str
+    tail: str
+
+class RenewalCandidate(NamedTuple):
+    contract_id: int
+    contract_end: date
+    contract_next_cancellation_date: date
+    contract_renewal_period_months: int
+
+class DueContract(NamedTuple):
+    """A contract that reached a reminder milestone."""
+    user_id: int
+    contract_id: int
+    contract_type: str
+    contractor_name: str
+    contract_renewal_period_months: int
+    contract_next_cancellation_date: date
+    days_left: int
+    milestone: Optional[int]
+
+class IndexedContract(NamedTuple):
+    """An active contract as kept in the in-memory due-date index (see contract_dueindex)."""
+    contract_id: int
+    user_id: int
+    contract_type: str
+    contractor_name: str
+    contract_renewal_period_months: int
+    contract_next_cancellation_date: date
+    alert_active: int
+    alert_last_milestone: Optional[int]
+
+class ExportRow(NamedTuple):
+    """One contract in /export, with all references resolved to names."""
+    contract_id: int
+    contract_category: str
+    contract_type: str
+    contractor_name: str
+    beneficiary: str
+    period_name: str
+    account_IBAN: str
+    contract_fee: Decimal
+    contract_start: date
+    contract_end: date
+    contract_next_cancellation_date: date
+    notice_period_months: int
+    contract_renewal_period_months: int
+    is_active: int
+    alert_active: int
+
+class ForecastContract(NamedTuple):
+    """An active contract with the fields the forecast (contract_forecast) projects."""
+    contract_id: int
+    contract_category: str
+    contract_type: str
+    contractor_name: str
+    beneficiary: str
+    contract_fee: Decimal
+    period_name: str
+    period_months: Optional[int]
+    contract_start: date
+    contract_end: date
+    contract_next_cancellation_date: date
+    notice_period_months: int
+    contract_renewal_period_months: int
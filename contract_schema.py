@@ -0,0 +1,326 @@
+"""Tables, columns and indexes the queries in contract_dbqueries rely on.
+
+Run this module once after deploying to create missing tables, columns and indexes:
+    python contract_schema.py
+Existing tables, columns and indexes are left untouched, so running it again is safe.
+Accounts and beneficiaries without owner that only one user's contracts refer to are
+assigned to that user (see backfillOwners).
+
+    python contract_schema.py check
+runs EXPLAIN on the statements of contract_dbqueries and reports full table scans.
+The optimizer may choose a full scan for tables with only a few rows, so run the check
+against a database with realistic data.
+"""
+import inspect
+import sys
+from datetime import date
+import contract_dbqueries
+
+# (table, definition) in the order they have to be created
+tables = [
+    ("users", "user_id BIGINT NOT NULL PRIMARY KEY"),
+    ("contract_categories", "contract_category_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, " +
+                            "contract_category VARCHAR(100) NOT NULL"),
+    ("contract_types", "contract_type_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, " +
+                       "contract_type VARCHAR(100) NOT NULL, " +
+                       "contract_category INT NOT NULL"),
+    ("contractors", "contractor_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, " +
+                    "contractor_name VARCHAR(200) NOT NULL"),
+    ("contract_beneficiaries", "id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, " +
+                               "user_id BIGINT NULL, " +
+                               "name VARCHAR(200) NOT NULL"),
+    ("payment_periods", "period_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, " +
+                        "period_name VARCHAR(50) NOT NULL, " +
+                        "period_months SMALLINT NULL"),
+    ("bankaccounts", "account_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, " +
+                     "user_id BIGINT NULL, " +
+                     "account_IBAN VARCHAR(34) NOT NULL"),
+    ("contracts", "contract_id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, " +
+                  "user_id BIGINT NOT NULL, " +
+                  "contract_type INT NOT NULL, " +
+                  "contract_beneficiary_1 INT NOT NULL, " +
+                  "contractor INT NOT NULL, " +
+                  "contract_fee DECIMAL(10,2) NOT NULL, " +
+                  "contract_payment_period INT NOT NULL, " +
+                  "bankaccount INT NOT NULL, " +
+                  "notice_period_months INT NOT NULL DEFAULT 0, " +
+                  "contract_start DATE NULL, " +
+                  "contract_end DATE NULL, " +
+                  "contract_next_cancellation_date DATE NULL, " +
+                  "contract_renewal_period_months INT NOT NULL DEFAULT 0, " +
+                  "is_active TINYINT NOT NULL DEFAULT 1, " +
+                  "alert_active TINYINT NOT NULL DEFAULT 0, " +
+                  "alert_last_notified DATE NULL, " +
+                  "alert_last_milestone SMALLINT NULL"),
+]
+
+# (table, column, definition) for databases created before the column existed
+columns = [
+    # reminder bookkeeping, see getDueContracts/markContractsNotified
+    ("contracts", "alert_last_notified", "DATE NULL"),
+    ("contracts", "alert_last_milestone", "SMALLINT NULL"),
+    # owner of accounts and beneficiaries, NULL for rows shared by all users
+    ("bankaccounts", "user_id", "BIGINT NULL"),
+    ("contract_beneficiaries", "user_id", "BIGINT NULL"),
+    # months between two payments (0 = one-off), used by contract_forecast; NULL falls back to the period name
+    ("payment_periods", "period_months", "SMALLINT NULL"),
+]
+
+# (table, column, default) for columns whose default changed since they were created
+columnDefaults = [
+    # reminders are only active if the user answered "ja" in the conversation (setContractAlertingStatus)
+    ("contracts", "alert_active", "0"),
+]
+
+# (table, index name, columns)
+indexes = [
+    # getDueContracts: user, active/alerting flags and the reminder window on the cancellation date
+    ("contracts", "idx_contracts_due", "user_id, is_active, alert_active, contract_next_cancellation_date"),
+    # getOverdueContracts: nightly renewal run in contracts_datechecker
+    ("contracts", "idx_contracts_renewal", "is_active, contract_next_cancellation_date"),
+    # getContracts(Page), getAllContracts, getContractById: a user's contracts of a type in id order
+    ("contracts", "idx_contracts_user_type", "user_id, contract_type, contract_id"),
+    # getActiveContractCategories(Page): types in which a user has active contracts
+    ("contracts", "idx_contracts_user_active_type", "user_id, is_active, contract_type"),
+    # resolveNames (contract import): categories by name
+    ("contract_categories", "idx_contract_categories_name", "contract_category"),
+    # getContractTypes, resolveTypes: types of a category
+    ("contract_types", "idx_contract_types_category", "contract_category, contract_type_id"),
+    # getAccounts/getBeneficiaries: a user's rows and the shared ones (user_id IS NULL)
+    ("bankaccounts", "idx_bankaccounts_user", "user_id, account_id"),
+    ("contract_beneficiaries", "idx_contract_beneficiaries_user", "user_id, id"),
+    # getContractorsPage: keyset over the name; resolveNames (contract import): contractors by name
+    ("contractors", "idx_contractors_name", "contractor_name, contractor_id"),
+]
+
+@contract_dbqueries.queryWrapper
+def tableExists(cur, table):
+    cur.execute("SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s LIMIT 1",
+                (table,))
+    return len(cur.fetchall()) > 0
+
+@contract_dbqueries.queryWrapper
+def createTable(cur, table, definition):
+    cur.execute("CREATE TABLE IF NOT EXISTS " + table + " (" + definition + ")")
+
+def createTables():
+    for table, definition in tables:
+        if tableExists(table):
+            continue
+        print("creating table " + table)
+        createTable(table, definition)
+
+@contract_dbqueries.queryWrapper
+def columnExists(cur, table, column):
+    cur.execute("SELECT 1 FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s LIMIT 1",
+                (table, column))
+    return len(cur.fetchall()) > 0
+
+@contract_dbqueries.queryWrapper
+def addColumn(cur, table, column, definition):
+    cur.execute("ALTER TABLE " + table + " ADD COLUMN " + column + " " + definition)
+
+def addColumns():
+    for table, column, definition in columns:
+        if columnExists(table, column):
+            continue
+        print("adding column " + column + " to " + table)
+        addColumn(table, column, definition)
+
+@contract_dbqueries.queryWrapper
+def columnDefault(cur, table, column):
+    cur.execute("SELECT column_default FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s LIMIT 1",
+                (table, column))
+    rows = cur.fetchall()
+    if not rows or rows[0][0] is None:
+        return None
+    value = rows[0][0]
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode()
+    # MariaDB quotes literal defaults, MySQL does not
+    return str(value).strip("'")
+
+@contract_dbqueries.queryWrapper
+def setColumnDefault(cur, table, column, default):
+    cur.execute("ALTER TABLE " + table + " ALTER COLUMN " + column + " SET DEFAULT " + default)
+
+def setColumnDefaults():
+    for table, column, default in columnDefaults:
+        if columnDefault(table, column) == default:
+            continue
+        print("setting default of " + table + "." + column + " to " + default)
+        setColumnDefault(table, column, default)
+
+@contract_dbqueries.queryWrapper
+def indexExists(cur, table, indexName):
+    cur.execute("SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1",
+                (table, indexName))
+    return len(cur.fetchall()) > 0
+
+@contract_dbqueries.queryWrapper
+def createIndex(cur, table, indexName, columns):
+    cur.execute("CREATE INDEX " + indexName + " ON " + table + " (" + columns + ")")
+
+def createIndexes():
+    for table, indexName, columns in indexes:
+        if indexExists(table, indexName):
+            continue
+        print("creating index " + indexName + " on " + table + " (" + columns + ")")
+        createIndex(table, indexName, columns)
+
+# (table, key column, contracts column referencing it): rows whose user_id is filled in by backfillOwners
+ownedTables = [
+    ("bankaccounts", "account_id", "bankaccount"),
+    ("contract_beneficiaries", "id", "contract_beneficiary_1"),
+]
+
+@contract_dbqueries.queryWrapper
+def backfillOwner(cur, table, keyColumn, contractsColumn):
+    cur.execute("UPDATE " + table + " JOIN (SELECT " + contractsColumn + " AS row_id, MIN(user_id) AS owner FROM contracts " +
+                "GROUP BY " + contractsColumn + " HAVING COUNT(DISTINCT user_id) = 1) owners ON owners.row_id = " + table + "." + keyColumn + " " +
+                "SET " + table + ".user_id = owners.owner WHERE " + table + ".user_id IS NULL")
+    return cur.rowcount
+
+def backfillOwners():
+    """Give accounts and beneficiaries without owner to the user whose contracts use them.
+    Rows used by several users (or by none) stay shared (user_id NULL)."""
+    for table, keyColumn, contractsColumn in ownedTables:
+        count = backfillOwner(table, keyColumn, contractsColumn)
+        if count:
+            print("assigned " + str(count) + " row(s) of " + table + " to their user")
+
+def migrate():
+    createTables()
+    addColumns()
+    setColumnDefaults()
+    backfillOwners()
+    createIndexes()
+
+
+class ExplainCursor:
+    """Stands in for the cursor of a query function: runs EXPLAIN instead of the statement
+    and collects the plans. Nothing is read or written, fetches return no rows.
+    Also stands in for the UnitOfWork the import lookups (resolveNames, resolveTypes) take."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.plans = []
+        self.rowcount = 0
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        cur = self.conn.cursor(dictionary=True)
+        try:
+            cur.execute("EXPLAIN " + sql, params)
+            self.plans.append((sql, cur.fetchall()))
+        finally:
+            cur.close()
+        return self
+
+    def executemany(self, sql, seqParams):
+        for params in seqParams:
+            self.execute(sql, params)
+            break
+
+    insertMany = executemany
+
+    def fetchall(self):
+        return []
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        pass
+
+today = date.today()
+
+# (query function, sample arguments) for every query that runs through a cursor.
+# saveContract is not listed, it only runs INSERT ... VALUES.
+checkedQueries = [
+    (contract_dbqueries.isValidUser, (0,)),
+    (contract_dbqueries.getAllActiveContracts, ()),
+    (contract_dbqueries.deleteContractById, (0, 0)),
+    (contract_dbqueries.getActiveContractCategories, (0,)),
+    (contract_dbqueries.getContractCategories, ()),
+    (contract_dbqueries.getActiveContractCategoriesPage, (0, None, 9)),
+    (contract_dbqueries.getContractCategoriesPage, (None, 9)),
+    (contract_dbqueries.getContractTypes, (0,)),
+    (contract_dbqueries.getAllContracts, (0,)),
+    (contract_dbqueries.getContracts, (0, 0)),
+    (contract_dbqueries.getContractsPage, (0, 0, None, 9)),
+    (contract_dbqueries.getDueContracts, ([0], today, (14, 7, 1))),
+    (contract_dbqueries.markContractsNotified, ([(0, 14)], today)),
+    (contract_dbqueries.getBeneficiaries, (0,)),
+    (contract_dbqueries.getContractors, ()),
+    (contract_dbqueries.getContractorsPage, (("", 0), 9)),
+    (contract_dbqueries.getPeriods, ()),
+    (contract_dbqueries.getAccounts, (0,)),
+    (contract_dbqueries.getContractById, (0, 0)),
+    (contract_dbqueries.updateContractDates, ((0, today, today),)),
+    (contract_dbqueries.getOverdueContracts, (today,)),
+    (contract_dbqueries.renewContracts, ([[(0, today, today)]],)),
+    (contract_dbqueries.setContractAlertingStatus, (0, 0, 1)),
+    (contract_dbqueries.getIndexedContracts, ()),
+    (contract_dbqueries.getIndexedContract, (0,)),
+    (contract_dbqueries.getForecastContracts, (0,)),
+    (contract_dbqueries.selectExportRows, (0,)),
+    (contract_dbqueries.resolveNames, ("contract_categories", "contract_category_id", "contract_category", ["x"])),
+    (contract_dbqueries.resolveTypes, ([(0, "x")],)),
+    (contract_dbqueries.resolveNames, ("contractors", "contractor_id", "contractor_name", ["x"])),
+]
+
+# queries that read a whole reference table on purpose
+fullScansExpected = {
+    "getAllActiveContracts",
+    "getContractCategories",
+    "getContractors",
+    "getPeriods",
+    "getIndexedContracts",
+}
+
+def explainQueries():
+    """Return (query name, [(sql, plan rows)]) for every query in checkedQueries."""
+    results = []
+    conn = contract_dbqueries.getConnection()
+    try:
+        for func, args in checkedQueries:
+            cur = ExplainCursor(conn)
+            # call the undecorated function, so neither the pool nor the caches are involved
+            inspect.unwrap(func)(cur, *args)
+            results.append((func.__name__, cur.plans))
+    finally:
+        contract_dbqueries.releaseConnection(conn)
+    return results
+
+def check() -> int:
+    """Print the access type of every table each query reads and return the number of unexpected full table scans."""
+    problems = 0
+    for name, plans in explainQueries():
+        print(name)
+        for sql, rows in plans:
+            for row in rows:
+                if row.get("select_type") == "INSERT" or row.get("table") is None:
+                    continue
+                access = row.get("type")
+                note = ""
+                if access == "ALL":
+                    if name in fullScansExpected:
+                        note = "  (full table scan, expected)"
+                    else:
+                        note = "  FULL TABLE SCAN"
+                        problems += 1
+                elif access == "index":
+                    note = "  (full index scan)"
+                print("    " + str(row.get("table")) + ": " + str(access) + " key=" + str(row.get("key")) + " rows=" + str(row.get("rows")) + note)
+    print(str(problems) + " unexpected full table scan(s)")
+    return problems
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "check":
+        sys.exit(1 if check() else 0)
+    migrate()
+
+
+if __name__ == "__main__":
+    main()
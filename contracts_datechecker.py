@@ -2,37 +2,43 @@ import contract_dbqueries
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
-#Get all contracts (that are still active)
+# Number of contracts written per UPDATE statement
+renewalBatchSize = 500
+
+def renewalPeriodsDue(nextcanceldate, renewalperiod, now):
+    """Number of renewal periods needed to move the next cancellation date back to today or later."""
+    monthsBehind = (now.year - nextcanceldate.year) * 12 + now.month - nextcanceldate.month
+    periods = max(1, monthsBehind // renewalperiod)
+    while now > nextcanceldate + relativedelta(months=+periods * renewalperiod):
+        periods += 1
+    return periods
+
+def computeRenewals(contracts, now):
+    """New end and cancellation dates for overdue contracts, in batches of renewalBatchSize."""
+    for start in range(0, len(contracts), renewalBatchSize):
+        batch = []
+        for contractId, enddate, nextcanceldate, renewalperiod in contracts[start:start + renewalBatchSize]:
+            #Vertrag wurde automatisch (ggf. mehrfach) verlängert
+            renewalperiod = int(renewalperiod)
+            months = renewalPeriodsDue(nextcanceldate, renewalperiod, now) * renewalperiod
+            # contracts without end date (contract_end NULL) only get a new cancellation date
+            if enddate is not None:
+                enddate = enddate + relativedelta(months=+months)
+            batch.append((contractId, enddate, nextcanceldate + relativedelta(months=+months)))
+        yield batch
+
+#Get all contracts (that are still active) whose cancellation date has passed
 def checkDates():
-    contracts= contract_dbqueries.getAllActiveContracts()
-    #print(contracts)
     now =  datetime.now().date()
-
-    for c in contracts:
-        enddate = datetime.strptime(str(c[2]), '%Y-%m-%d').date()
-        
-        nextcanceldate = datetime.strptime(str(c[3]), '%Y-%m-%d').date()
-        
-        if(now > nextcanceldate):
-            #Vertrag wurde automatisch verlängert
-            renewalperiod = int(c[5])
-            newenddate = enddate + relativedelta(months=+renewalperiod) 
-            newnextcanceldate = nextcanceldate + relativedelta(months=+renewalperiod)
-            newenddatestring = str(newenddate)
-            newnextcanceldatestring = str(newnextcanceldate)
-            data = []
-            data.append(c[0])
-            data.append(newenddatestring)
-            data.append(newnextcanceldatestring)
-            contract_dbqueries.updateContractDates(data)
-        
-        else:
-            #Ende der Vertragslaufzeit noch nicht erreicht
-            continue
+    contracts = contract_dbqueries.getOverdueContracts(now)
+    if not contracts:
+        return 0
+    return contract_dbqueries.renewContracts(computeRenewals(contracts, now))
 
 def main():
-    checkDates()
+    renewed = checkDates()
+    print(str(renewed)+" contracts renewed")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,275 @@
+"""End-to-end latency benchmark of the conversation in chatbot_4.
+
+Builds the same handlers as the bot (chatbot_4.addHandlers) and feeds them synthetic updates
+through the same update processor, with two replacements:
+- the Bot talks to FakeTelegram instead of api.telegram.org, so every reply is serialized
+  as usual but answered locally,
+- the query functions of contract_dbqueries are replaced by FakeDatabase, which answers from
+  memory (optionally after a simulated query latency). The queries still run on the executor
+  of contract_dbqueries_async.
+
+Every simulated user runs the "show contract" and "new contract" flows in turns. The benchmark
+reports p50/p95/p99 latency per conversation state and updates per second for each concurrency level:
+    python conversation_benchmark.py --concurrency 1 8 32 --rounds 20 --query-latency 2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import math
+import statistics
+import time
+from datetime import date
+from http import HTTPStatus
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+import chatbot_4
+import contract_dbqueries
+from contract_rows import Category, ContractType, Beneficiary, Contractor, Period, Account, ContractListItem, ContractDetails
+from update_processor import ChatOrderedUpdateProcessor
+
+# (conversation state the update is handled in, kind of update, text or callback data)
+showContractFlow = [
+    ("entry", "command", "/start"),
+    ("CHOOSE", "callback", "showcontract"),
+    ("CATEGORY", "callback", "1"),
+    ("TYPE", "callback", "1"),
+    ("CONTRACT", "callback", "1"),
+    ("DETAILS", "callback", "end"),
+]
+
+newContractFlow = [
+    ("entry", "command", "/start"),
+    ("CHOOSE", "callback", "newcontract"),
+    ("SETCATEGORY", "callback", "1"),
+    ("SETTYPE", "callback", "1"),
+    ("SETBENEFICIARY", "callback", "1"),
+    ("SETCONTRACTOR", "callback", "1"),
+    ("SETFEE", "message", "12,99"),
+    ("SETACCOUNT", "callback", "1"),
+    ("SETNOTICEPERIOD", "callback", "1"),
+    ("SETRENEWALPERIOD", "message", "3"),
+    ("SETSTARTDATE", "message", "12"),
+    ("SETENDDATE", "message", "01.01.2024"),
+    ("SAVECONTRACT", "message", "31.12.2025"),
+    ("CONTRACT_ALERTING", "callback", "activate_alerting"),
+]
+
+botUser = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+
+class FakeTelegram(BaseRequest):
+    """Answers every Bot API call locally with a minimal successful result."""
+
+    def __init__(self):
+        self.calls = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        self.calls += 1
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data is not None else {}
+        if endpoint == "getMe":
+            result = botUser
+        elif endpoint in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+            chatId = parameters.get("chat_id", 0)
+            result = {"message_id": parameters.get("message_id", 1), "date": 0,
+                      "chat": {"id": chatId, "type": "private"}, "from": botUser, "text": parameters.get("text", "")}
+        else:
+            result = True
+        return HTTPStatus.OK, json.dumps({"ok": True, "result": result}).encode()
+
+
+class FakeDatabase:
+    """In-memory stand-in for the query functions of contract_dbqueries the conversation uses."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.queries = 0
+        self.savedContracts = 0
+        self.nextContractId = 1000
+
+    def query(self):
+        self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def install(self) -> None:
+        for name in ("isValidUser", "getContractCategoriesPage", "getActiveContractCategoriesPage", "getContractTypes",
+                     "getContractsPage", "getBeneficiaries", "getContractorsPage", "getPeriods", "getAccounts",
+                     "getContractById", "saveContract", "setContractAlertingStatus", "deleteContractById"):
+            setattr(contract_dbqueries, name, getattr(self, name))
+
+    def isValidUser(self, userId):
+        self.query()
+        return [(1,)]
+
+    def getContractCategoriesPage(self, afterId, limit):
+        self.query()
+        return [Category(i, "Kategorie " + str(i)) for i in range((afterId or 0) + 1, 13)][:limit]
+
+    def getActiveContractCategoriesPage(self, userId, afterId, limit):
+        self.query()
+        return [Category(i, "Kategorie " + str(i)) for i in range((afterId or 0) + 1, 6)][:limit]
+
+    def getContractTypes(self, category):
+        self.query()
+        return [ContractType(i, "Art " + str(i)) for i in range(1, 5)]
+
+    def getContractsPage(self, userId, type, afterId, limit):
+        self.query()
+        return [ContractListItem(i, "Art " + str(type), "Anbieter " + str(i)) for i in range((afterId or 0) + 1, 4)][:limit]
+
+    def getBeneficiaries(self, userId):
+        self.query()
+        return [Beneficiary(1, "Ich"), Beneficiary(2, "Familie")]
+
+    def getContractorsPage(self, afterKey, limit):
+        self.query()
+        return [Contractor(i, "Anbieter " + str(i)) for i in range(1, 21)][:limit]
+
+    def getPeriods(self):
+        self.query()
+        return [Period(1, "monatlich"), Period(2, "jährlich")]
+
+    def getAccounts(self, userId):
+        self.query()
+        return [Account(1, "DE02120300000000202051")]
+
+    def getContractById(self, userId, id):
+        self.query()
+        return ContractDetails(id, "12.99", "Ich", "monatlich", "Anbieter 1", "Art 1", "DE02120300000000202051", date(2030, 1, 1))
+
+    def saveContract(self, data):
+        self.query()
+        self.savedContracts += 1
+        self.nextContractId += 1
+        return (self.nextContractId,)
+
+    def setContractAlertingStatus(self, userId, contractId, alertingStatus):
+        self.query()
+
+    def deleteContractById(self, userId, Id):
+        self.query()
+
+
+def makeUpdate(updateId: int, userId: int, kind: str, payload: str, bot) -> Update:
+    user = {"id": userId, "is_bot": False, "first_name": "User" + str(userId)}
+    chat = {"id": userId, "type": "private"}
+    if kind == "callback":
+        data = {"update_id": updateId, "callback_query": {
+            "id": str(updateId), "from": user, "chat_instance": "benchmark", "data": payload,
+            "message": {"message_id": 1, "date": 0, "chat": chat, "from": botUser, "text": "..."}}}
+    else:
+        message = {"message_id": updateId, "date": 0, "chat": chat, "from": user, "text": payload}
+        if kind == "command":
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(payload)}]
+        data = {"update_id": updateId, "message": message}
+    return Update.de_json(data, bot)
+
+def percentile(sortedValues, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, math.ceil(p / 100 * len(sortedValues)) - 1)
+    return sortedValues[index]
+
+async def runLevel(concurrency: int, rounds: int, database: FakeDatabase) -> dict:
+    """Run rounds of both flows for concurrency users at the same time and collect latencies per state."""
+    telegram = FakeTelegram()
+    application = (Application.builder().token("123456:BENCHMARK").request(telegram).get_updates_request(FakeTelegram())
+                   .concurrent_updates(ChatOrderedUpdateProcessor(concurrency)).build())
+    chatbot_4.addHandlers(application)
+    errors = []
+
+    async def countError(update, context):
+        errors.append(context.error)
+
+    application.add_error_handler(countError)
+    latencies = {}
+    counter = iter(range(1, 10 ** 9))
+
+    async def user(userId: int) -> None:
+        for i in range(rounds):
+            for state, kind, payload in (showContractFlow if i % 2 == 0 else newContractFlow):
+                update = makeUpdate(next(counter), userId, kind, payload, application.bot)
+                started = time.perf_counter()
+                await application.update_processor.process_update(update, application.process_update(update))
+                latencies.setdefault(state, []).append(time.perf_counter() - started)
+
+    savedBefore = database.savedContracts
+    async with application:
+        started = time.perf_counter()
+        await asyncio.gather(*[user(10000 + i) for i in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    updates = sum(len(values) for values in latencies.values())
+    states = {}
+    for state, values in latencies.items():
+        values.sort()
+        states[state] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "mean_ms": statistics.fmean(values) * 1000,
+        }
+    return {
+        "concurrency": concurrency,
+        "updates": updates,
+        "seconds": elapsed,
+        "updates_per_second": updates / elapsed if elapsed else 0.0,
+        "errors": len(errors),
+        "saved_contracts": database.savedContracts - savedBefore,
+        "expected_saved_contracts": concurrency * (rounds // 2),
+        "api_calls": telegram.calls,
+        "states": states,
+    }
+
+def printLevel(result: dict) -> None:
+    print("concurrency " + str(result["concurrency"]) + ": " + str(result["updates"]) + " updates in " +
+          "%.2fs, %.0f updates/s, %d errors, %d/%d contracts saved" % (result["seconds"], result["updates_per_second"], result["errors"],
+                                                                     result["saved_contracts"], result["expected_saved_contracts"]))
+    print("    %-18s %7s %9s %9s %9s" % ("state", "count", "p50 ms", "p95 ms", "p99 ms"))
+    for state, s in result["states"].items():
+        print("    %-18s %7d %9.2f %9.2f %9.2f" % (state, s["count"], s["p50_ms"], s["p95_ms"], s["p99_ms"]))
+
+async def runBenchmark(levels, rounds: int, queryLatency: float) -> list:
+    database = FakeDatabase(queryLatency)
+    database.install()
+    results = []
+    for concurrency in levels:
+        # the handlers print a lot; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = await runLevel(concurrency, rounds, database)
+        printLevel(result)
+        results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency benchmark of the bot conversation")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="numbers of simulated users running at the same time")
+    parser.add_argument("--rounds", type=int, default=10, help="flows per user, alternating show and new contract")
+    parser.add_argument("--query-latency", type=float, default=0.0, help="simulated time per query in milliseconds")
+    parser.add_argument("--json", help="also write the results to this file, e.g. to compare runs")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = asyncio.run(runBenchmark(args.concurrency, args.rounds, args.query_latency / 1000))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
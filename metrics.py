@@ -0,0 +1,184 @@
+"""Latency histograms and counters in the Prometheus text format.
+
+Query functions (contract_dbqueries.queryWrapper/transactionWrapper), conversation callbacks
+(chatbot_4.buildConversationHandler) and jobs (sendAlert) are timed here. startServer() serves
+everything on http://127.0.0.1:<port>/metrics for a local Prometheus to scrape.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+defaultBuckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+metrics = []
+
+def formatLabels(labelNames, labelValues, extra=()) -> str:
+    pairs = list(zip(labelNames, labelValues)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join(name + "=\"" + value + "\"" for name, value in escaped) + "}"
+
+def formatValue(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name: str, help: str, labelNames=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.values = {}
+        self.lock = threading.Lock()
+        metrics.append(self)
+
+    def inc(self, *labelValues, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labelValues] = self.values.get(labelValues, 0) + amount
+
+    def render(self) -> list:
+        lines = ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " counter"]
+        with self.lock:
+            for labelValues, value in sorted(self.values.items()):
+                lines.append(self.name + formatLabels(self.labelNames, labelValues) + " " + formatValue(value))
+        return lines
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label combination."""
+
+    def __init__(self, name: str, help: str, labelNames=(), buckets=defaultBuckets):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> [bucket counts..., sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+        metrics.append(self)
+
+    def observe(self, value: float, *labelValues) -> None:
+        with self.lock:
+            entry = self.values.get(labelValues)
+            if entry is None:
+                entry = self.values[labelValues] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self) -> list:
+        lines = ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " histogram"]
+        with self.lock:
+            for labelValues, entry in sorted(self.values.items()):
+                for i, bound in enumerate(self.buckets):
+                    lines.append(self.name + "_bucket" + formatLabels(self.labelNames, labelValues, [("le", formatValue(bound))]) + " " + str(entry[i]))
+                lines.append(self.name + "_sum" + formatLabels(self.labelNames, labelValues) + " " + formatValue(entry[-2]))
+                lines.append(self.name + "_count" + formatLabels(self.labelNames, labelValues) + " " + str(entry[-1]))
+        return lines
+
+
+class Gauge:
+    """Values read from read() at scrape time; read returns {label values tuple: number}."""
+
+    def __init__(self, name: str, help: str, labelNames, read):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.read = read
+        metrics.append(self)
+
+    def render(self) -> list:
+        lines = ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " gauge"]
+        try:
+            values = self.read()
+        except Exception:
+            logger.exception("Reading gauge %s failed", self.name)
+            return lines
+        for labelValues, value in sorted(values.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(self.name + formatLabels(self.labelNames, labelValues) + " " + formatValue(value))
+        return lines
+
+
+queryLatency = Histogram("contracts_db_query_seconds", "Duration of contract_dbqueries functions, including the wait for a connection", ["query"])
+queryErrors = Counter("contracts_db_query_errors_total", "contract_dbqueries functions that raised", ["query"])
+handlerLatency = Histogram("contracts_handler_seconds", "Duration of conversation callbacks", ["state", "handler"])
+handlerErrors = Counter("contracts_handler_errors_total", "Conversation callbacks that raised", ["state", "handler"])
+jobLatency = Histogram("contracts_job_seconds", "Duration of job queue runs", ["job"], buckets=defaultBuckets + (60.0, 300.0))
+jobErrors = Counter("contracts_job_errors_total", "Job queue runs that raised", ["job"])
+
+@contextmanager
+def observed(histogram: Histogram, errors: Counter, *labelValues):
+    """Time the block into histogram, count it in errors if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        errors.inc(*labelValues)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - started, *labelValues)
+
+def timedQuery(func):
+    """Record duration and errors of a query function under its name."""
+    name = func.__name__
+    @wraps(func)
+    def inner(*args, **kwargs):
+        with observed(queryLatency, queryErrors, name):
+            return func(*args, **kwargs)
+    return inner
+
+def timedCallback(callback, state: str):
+    """Record duration and errors of a conversation callback, labelled by the state it runs in."""
+    name = callback.__name__
+    @wraps(callback)
+    async def inner(update, context):
+        with observed(handlerLatency, handlerErrors, state, name):
+            return await callback(update, context)
+    return inner
+
+def timedJob(callback):
+    name = callback.__name__
+    @wraps(callback)
+    async def inner(context):
+        with observed(jobLatency, jobErrors, name):
+            return await callback(context)
+    return inner
+
+def render() -> str:
+    lines = []
+    for metric in list(metrics):
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def startServer(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics in a daemon thread and return the server (server.shutdown() stops it)."""
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Metrics on http://%s:%d/metrics", host, server.server_address[1])
+    return server
@@ -0,0 +1,84 @@
+"""Inline keyboards that show one page of database rows at a time.
+
+Each page is fetched with a keyset query (rows after the key of the last row of the previous page),
+so a screen never loads more than one page. The keys of the visited pages are kept in
+context.user_data, the buttons only carry "page-prev"/"page-next".
+"""
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+
+PREV = "page-prev"
+NEXT = "page-next"
+# pattern for the CallbackQueryHandler that turns pages, see turnPage()
+pagePattern = "^page-(prev|next)$"
+
+keyboards = {}
+
+class PaginatedKeyboard:
+    """Keyboard over the rows returned by fetchPage(*args, afterKey, limit).
+
+    keyOf(row) returns the keyset position of a row (passed as afterKey for the next page),
+    makeButton(row) the InlineKeyboardButton for a row. extraRows(*args) may add fixed rows below the page.
+    """
+
+    def __init__(self, name, fetchPage, keyOf, makeButton, pageSize: int = 8, columns: int = 1, extraRows=None):
+        self.name = name
+        self.fetchPage = fetchPage
+        self.keyOf = keyOf
+        self.makeButton = makeButton
+        self.pageSize = pageSize
+        self.columns = columns
+        self.extraRows = extraRows
+        keyboards[name] = self
+
+    def state(self, context: ContextTypes.DEFAULT_TYPE) -> dict:
+        return context.user_data.setdefault("pages", {}).setdefault(self.name, {"args": (), "keys": [None], "last": None, "more": False})
+
+    async def firstPage(self, context: ContextTypes.DEFAULT_TYPE, *args):
+        """Render the first page and make this the keyboard that page buttons refer to.
+        Returns (markup, number of rows on the page)."""
+        context.user_data.setdefault("pages", {})[self.name] = {"args": args, "keys": [None], "last": None, "more": False}
+        context.user_data["activeKeyboard"] = self.name
+        return await self.render(context)
+
+    async def turnPage(self, context: ContextTypes.DEFAULT_TYPE, forward: bool):
+        state = self.state(context)
+        if forward and state["more"]:
+            state["keys"].append(state["last"])
+        elif not forward and len(state["keys"]) > 1:
+            state["keys"].pop()
+        return await self.render(context)
+
+    async def render(self, context: ContextTypes.DEFAULT_TYPE):
+        state = self.state(context)
+        rows = await self.fetchPage(*state["args"], state["keys"][-1], self.pageSize + 1)
+        state["more"] = len(rows) > self.pageSize
+        rows = rows[:self.pageSize]
+        state["last"] = self.keyOf(rows[-1]) if rows else None
+
+        keyboard = []
+        buttons = [self.makeButton(row) for row in rows]
+        for i in range(0, len(buttons), self.columns):
+            keyboard.append(buttons[i:i + self.columns])
+        navigation = []
+        if len(state["keys"]) > 1:
+            navigation.append(InlineKeyboardButton("\U000025C0", callback_data=PREV))
+        if state["more"]:
+            navigation.append(InlineKeyboardButton("\U000025B6", callback_data=NEXT))
+        if navigation:
+            keyboard.append(navigation)
+        if self.extraRows:
+            keyboard += self.extraRows(*state["args"])
+        return InlineKeyboardMarkup(keyboard), len(rows)
+
+
+async def turnPage(update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Callback for the page buttons of the active keyboard. Keeps the conversation state."""
+    query = update.callback_query
+    await query.answer()
+    keyboard = keyboards.get(context.user_data.get("activeKeyboard"))
+    if keyboard is None:
+        return None
+    reply_markup, _ = await keyboard.turnPage(context, query.data == NEXT)
+    await query.edit_message_reply_markup(reply_markup=reply_markup)
+    return None
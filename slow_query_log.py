@@ -0,0 +1,92 @@
+"""Log of statements that take longer than a threshold.
+
+contract_dbqueries.PreparedCursor times every statement. Slow ones are written as one JSON object per
+line to a rotating log file, together with the EXPLAIN plan (captured on the same connection once
+the statement's rows are read), the query function and the bot handler that caused them:
+    {"time": ..., "duration_ms": 412.3, "query": "getContractById", "handler": "CONTRACT:contract",
+     "sql": "SELECT ... WHERE contracts.contract_id = ? AND contracts.user_id = ?", "params": ["int", "int"], "plan": [...]}
+Parameters are redacted to their types, so no user data ends up in the log.
+"""
+import json
+import logging
+import re
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+
+# Statements taking at least this many seconds are logged; None switches the log off
+threshold = None
+
+logger = logging.getLogger("contracts.slowqueries")
+logger.propagate = False
+
+# the handler (or job) on whose behalf queries run, e.g. "CONTRACT:contract"
+currentHandler = ContextVar("currentHandler", default=None)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; fields passed as extra={"fields": {...}} are merged in."""
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        data.update(getattr(record, "fields", {}))
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+def configure(path: str = "slow_queries.log", thresholdSeconds: float = 0.2, maxBytes: int = 10 * 1024 * 1024, backupCount: int = 5) -> None:
+    """Switch the slow-query log on, writing to path (rotated at maxBytes, backupCount old files kept)."""
+    global threshold
+    handler = RotatingFileHandler(path, maxBytes=maxBytes, backupCount=backupCount, encoding="utf-8")
+    handler.setFormatter(JsonFormatter())
+    for old in list(logger.handlers):
+        logger.removeHandler(old)
+        old.close()
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    threshold = thresholdSeconds
+
+def tracked(callback, name: str):
+    """Run callback with currentHandler set to name, so queries it causes can be traced back to it."""
+    @wraps(callback)
+    async def inner(*args, **kwargs):
+        token = currentHandler.set(name)
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            currentHandler.reset(token)
+    return inner
+
+def normalizeSql(sql: str) -> str:
+    """SQL with literals and placeholders replaced by ? and generated lists collapsed,
+    so all executions of a statement look the same whatever their batch size."""
+    sql = re.sub(r"\s+", " ", sql).strip()
+    sql = re.sub(r"'(?:[^'\\]|\\.)*'", "?", sql)
+    sql = re.sub(r"%s|\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\?(?:, \?)+\)", "(?, ...)", sql)
+    sql = re.sub(r"(WHEN [^W]*? THEN \?)(?: WHEN [^W]*? THEN \?)+", r"\1 ...", sql)
+    return sql
+
+def redactParams(params) -> list:
+    """Only the types of the bound parameters (and lengths of strings), never their values."""
+    redacted = []
+    for value in params or ():
+        if value is None:
+            redacted.append(None)
+        elif isinstance(value, str):
+            redacted.append("str(" + str(len(value)) + ")")
+        else:
+            redacted.append(type(value).__name__)
+    return redacted
+
+def record(sql: str, params, duration: float, queryName, plan) -> None:
+    logger.warning("slow query", extra={"fields": {
+        "duration_ms": round(duration * 1000, 1),
+        "query": queryName,
+        "handler": currentHandler.get(),
+        "sql": normalizeSql(sql),
+        "params": redactParams(params),
+        "plan": plan,
+    }})
@@ -0,0 +1,54 @@
+from datetime import date
+from decimal import Decimal
+import pytest
+import contract_dbqueries
+
+class FakeUnitOfWork:
+    inserted = []
+
+    def __init__(self, queryName=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def afterCommit(self, callback):
+        pass
+
+    def insertMany(self, sql, seqParams):
+        FakeUnitOfWork.inserted += seqParams
+
+def contract(line, category, type, contractor):
+    return {"line": line, "category": category, "type": type, "contractor": contractor, "beneficiary": 1, "fee": Decimal("9.99"),
+            "period": 1, "account": 1, "noticeperiod": 1, "renewalperiod": 12, "startdate": date(2026, 1, 1),
+            "enddate": date(2026, 12, 31), "nextcancellationdate": date(2026, 11, 30)}
+
+@pytest.fixture
+def database(monkeypatch):
+    FakeUnitOfWork.inserted = []
+    monkeypatch.setattr(contract_dbqueries, "unitOfWork", FakeUnitOfWork)
+    # the collation matched "Müll" to a differently spelled row, and type "Tarif" and contractor "EnBW" to nothing
+    categories = {"strom": 1}
+    contractors = {"stadt": 8}
+    monkeypatch.setattr(contract_dbqueries, "resolveNames",
+                        lambda uow, table, idColumn, nameColumn, names: categories if table == "contract_categories" else contractors)
+    monkeypatch.setattr(contract_dbqueries, "resolveTypes", lambda uow, types: {(1, "tonne"): 5})
+    return FakeUnitOfWork
+
+def test_unresolvedNamesAreReportedPerLine(database):
+    imported, errors = contract_dbqueries.importContracts(1, [
+        contract(2, "Strom", "Tonne", "Stadt"),
+        contract(3, "Strom", "Tarif", "Stadt"),
+        contract(4, "Müll", "Tonne", "Stadt"),
+        contract(5, "Strom", "Tonne", "EnBW"),
+    ])
+    assert imported == 1
+    assert [params[1] for params in database.inserted] == [5]
+    assert errors == [
+        (3, 'type "Tarif" konnte nicht zugeordnet werden'),
+        (4, 'category "Müll" konnte nicht zugeordnet werden'),
+        (5, 'contractor "EnBW" konnte nicht zugeordnet werden'),
+    ]
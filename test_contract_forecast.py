@@ -0,0 +1,59 @@
+from datetime import date
+from decimal import Decimal
+import numpy as np
+import contract_forecast
+from contract_rows import ForecastContract
+
+today = date(2026, 10, 18)
+
+def contract(**fields):
+    values = dict(contract_id=1, contract_category="Versicherung", contract_type="Haftpflicht", contractor_name="HUK",
+                  beneficiary="Ich", contract_fee=Decimal("10.00"), period_name="monatlich", period_months=1,
+                  contract_start=date(2024, 1, 1), contract_end=date(2027, 1, 31), contract_next_cancellation_date=None,
+                  notice_period_months=1, contract_renewal_period_months=12)
+    values.update(fields)
+    return ForecastContract(**values)
+
+def monthTotals(result):
+    return {month.item().strftime("%Y-%m"): total for month, total in zip(result.months, result.totals)}
+
+def test_addMonthsClipsToMonthEnd():
+    days = np.array(["2026-01-31", "2026-03-31", "2024-02-29"], dtype="datetime64[D]")
+    result = contract_forecast.addMonths(days, np.array([1, -1, 12]))
+    assert list(result.astype(str)) == ["2026-02-28", "2026-02-28", "2025-02-28"]
+
+def test_addMonthsKeepsNaT():
+    days = np.array(["NaT"], dtype="datetime64[D]")
+    assert np.isnat(contract_forecast.addMonths(days, np.array([3])))[0]
+
+def test_missingStartIsAnchoredAtCurrentMonth():
+    result = contract_forecast.forecast([contract(contract_start=None)], today)
+    totals = monthTotals(result)
+    assert totals["2026-10"] == 10
+    assert totals["2026-12"] == 10
+    assert result.totals.sum() == 10 * contract_forecast.horizonMonths
+
+def test_quarterlyPaymentsFollowStart():
+    result = contract_forecast.forecast([contract(period_months=3, contract_start=date(2026, 9, 1))], today)
+    totals = monthTotals(result)
+    assert [totals[m] for m in ("2026-10", "2026-11", "2026-12", "2027-01")] == [0, 0, 10, 0]
+
+def test_periodNameFallback():
+    assert contract_forecast.periodMonths(contract(period_months=None, period_name="Jährlich")) == 12
+
+def test_nonRenewingContractStopsAtEnd():
+    c = contract(contract_renewal_period_months=0, contract_end=date(2026, 12, 31))
+    result = contract_forecast.forecast([c], today)
+    totals = monthTotals(result)
+    assert totals["2026-12"] == 10
+    assert totals["2027-01"] == 0
+    assert result.totals.sum() == 30
+    assert [(day, kind) for day, kind, _ in result.events] == [(date(2026, 11, 30), "Kündigungsfrist"), (date(2026, 12, 31), "Vertragsende")]
+
+def test_renewalsShiftEndAndCancellationDates():
+    c = contract(contract_end=date(2026, 10, 31), contract_next_cancellation_date=date(2026, 9, 30))
+    events = contract_forecast.forecast([c], today).events
+    assert [(day, kind) for day, kind, _ in events] == [
+        (date(2026, 10, 31), "Verlängerung"),
+        (date(2027, 9, 30), "Kündigungsfrist"), (date(2027, 10, 31), "Verlängerung"),
+        (date(2028, 9, 30), "Kündigungsfrist")]
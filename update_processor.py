@@ -0,0 +1,64 @@
+"""Concurrent update processing that keeps the updates of one chat in order.
+
+Updates of different chats run concurrently (up to max_concurrent_updates), updates of the same
+chat wait for each other. This keeps the ConversationHandler state machine correct, which
+expects the answers of one user one after another.
+"""
+import logging
+from collections import deque
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently but strictly in order per chat.
+
+    process_update holds a concurrency slot while do_process_update runs. Only the first update of a
+    chat keeps its slot and works off the chat's queue; later updates of that chat are queued and
+    give their slot back at once, so one busy chat never blocks the others.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # chat id -> queue of coroutines, the first one is running
+        self.chatQueues = {}
+
+    @staticmethod
+    def chatKey(update):
+        chat = getattr(update, "effective_chat", None)
+        if chat is not None:
+            return chat.id
+        user = getattr(update, "effective_user", None)
+        if user is not None:
+            return user.id
+        return None
+
+    async def do_process_update(self, update, coroutine) -> None:
+        key = self.chatKey(update)
+        if key is None:
+            await coroutine
+            return
+        queue = self.chatQueues.get(key)
+        if queue is not None:
+            # the chat is busy, the update running for it processes this one afterwards
+            queue.append(coroutine)
+            return
+        queue = self.chatQueues[key] = deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue[0]
+                except Exception:
+                    logger.exception("Update for chat %s failed", key)
+                queue.popleft()
+        finally:
+            self.chatQueues.pop(key, None)
+            # only left over when processing was cancelled: the waiting updates are dropped
+            for waiting in list(queue)[1:]:
+                waiting.close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self.chatQueues.clear()
@@ -0,0 +1,40 @@
+"""Rules for values users type in, shared by the bot conversation and the contract import."""
+from datetime import date, datetime
+from decimal import Decimal
+from enum import Enum
+import re
+
+# User Input Types
+class UserInputType(Enum):
+    DATE = 1
+    MONETARY = 2
+    AMOUNT = 3
+
+
+# Mapping of UserInputType and RegEx to check
+userInputRegexMap = {
+    UserInputType.DATE : r"^(\d{2})\.(\d{2})\.(\d{4})$",
+    UserInputType.MONETARY : r"^(\d+,\d{2}|\d+)$",
+    UserInputType.AMOUNT : r"^\d+$"
+}
+
+# dates are also accepted as 2024-12-31, like in the conversation (SETENDDATE)
+isoDateRegex = r"^\d{4}-\d{2}-\d{2}$"
+
+def isValid(text: str, inputType: UserInputType) -> bool:
+    return re.search(userInputRegexMap[inputType], text) is not None
+
+def parseDate(text: str) -> date:
+    """31.12.2024 or 2024-12-31 as date; ValueError for anything else."""
+    matches = re.search(userInputRegexMap[UserInputType.DATE], text)
+    if matches:
+        text = matches.group(3)+"-"+matches.group(2)+"-"+matches.group(1)
+    elif not re.search(isoDateRegex, text):
+        raise ValueError(text)
+    return datetime.strptime(text, '%Y-%m-%d').date()
+
+def parseMonetary(text: str) -> Decimal:
+    """12,99 or 12 as Decimal; ValueError for anything else."""
+    if not isValid(text, UserInputType.MONETARY):
+        raise ValueError(text)
+    return Decimal(text.replace(",", "."))
@@ -0,0 +1,81 @@
+"""Webhook mode: receive Telegram updates over HTTP with Flask instead of long polling.
+
+Telegram (or anyone testing locally) POSTs update JSON to /telegram, e.g.
+    curl -X POST -H "Content-Type: application/json" -d @update.json http://localhost:8080/telegram
+The updates go into the update queue of the running Application, which processes them with its
+update processor (see update_processor.ChatOrderedUpdateProcessor).
+"""
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+import threading
+from flask import Flask, abort, request
+from werkzeug.serving import make_server
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+webhookPath = "/telegram"
+
+def createFlaskApp(application: Application, loop: asyncio.AbstractEventLoop, secretToken: str = None) -> Flask:
+    """Flask app that hands every posted update to the application running on loop."""
+    app = Flask(__name__)
+
+    @app.post(webhookPath)
+    def telegramUpdate():
+        if secretToken and not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secretToken):
+            abort(403)
+        data = request.get_json(force=True, silent=True)
+        if not data:
+            abort(400)
+        update = Update.de_json(data, application.bot)
+        asyncio.run_coroutine_threadsafe(application.update_queue.put(update), loop).result(timeout=10)
+        return "", 200
+
+    @app.get("/healthz")
+    def health():
+        return {"running": application.running, "pending_updates": application.update_queue.qsize()}
+
+    return app
+
+async def runWebhook(application: Application, listen: str = "127.0.0.1", port: int = 8080, url: str = None, secretToken: str = None) -> None:
+    """Run the application with a webhook server until SIGINT/SIGTERM.
+    Without url no webhook is registered at Telegram, which is what local testing needs.
+    With url every request has to carry secretToken; if none is given, a random one is
+    generated and registered with the webhook, so nobody else can post forged updates."""
+    if url and not secretToken:
+        secretToken = secrets.token_urlsafe(32)
+        logger.info("No webhook secret given, using a generated one")
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+
+    server = make_server(listen, port, createFlaskApp(application, loop, secretToken), threaded=True)
+    serverThread = threading.Thread(target=server.serve_forever, name="webhook", daemon=True)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        if url:
+            await application.bot.set_webhook(url + webhookPath, secret_token=secretToken, allowed_updates=Update.ALL_TYPES)
+        await application.start()
+        serverThread.start()
+        logger.info("Webhook server listening on %s:%d%s", listen, port, webhookPath)
+        await stopped.wait()
+    finally:
+        # shutdown() waits for serve_forever to return, which never happens if it was not started
+        if serverThread.is_alive():
+            server.shutdown()
+        server.server_close()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)